@@ -0,0 +1,88 @@
+"""Throughput of concurrent readers in the default and read-only open modes.
+
+Usage:
+    python examples/benchmarks/readonly_executor.py --db-path path/to/db.sqlite \
+        --sql "SELECT COUNT(*) FROM some_table" --num-processes 8
+
+Without --db-path a synthetic database is created in a temporary folder.
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from premsql.executors import OptimizedSQLiteExecutor
+
+
+def create_database(db_path: str, num_rows: int) -> str:
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE items (id INTEGER PRIMARY KEY, category TEXT, price REAL)"
+    )
+    conn.executemany(
+        "INSERT INTO items VALUES (?, ?, ?)",
+        ((i, f"category_{i % 50}", i * 0.5) for i in range(num_rows)),
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def run_reader(open_mode: str, db_path: str, sql: str, num_queries: int) -> float:
+    executor = OptimizedSQLiteExecutor(open_mode=open_mode)
+    start_time = time.perf_counter()
+    for _ in range(num_queries):
+        result = executor.execute_sql(sql=sql, dsn_or_db_path=db_path)
+        assert result["error"] is None, result["error"]
+    elapsed = time.perf_counter() - start_time
+    executor.close()
+    return elapsed
+
+
+def benchmark(open_mode: str, args) -> float:
+    with ProcessPoolExecutor(max_workers=args.num_processes) as pool:
+        start_time = time.perf_counter()
+        futures = [
+            pool.submit(run_reader, open_mode, args.db_path, args.sql, args.num_queries)
+            for _ in range(args.num_processes)
+        ]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start_time
+    return args.num_processes * args.num_queries / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", type=str, default=None)
+    parser.add_argument(
+        "--sql",
+        type=str,
+        default="SELECT category, AVG(price) FROM items GROUP BY category",
+    )
+    parser.add_argument("--num-processes", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--num-rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.db_path is None:
+            args.db_path = create_database(
+                os.path.join(tmp_dir, "benchmark.sqlite"), num_rows=args.num_rows
+            )
+
+        # The read-only run goes first, the default mode switches the file to WAL
+        for open_mode in ["readonly", "default"]:
+            throughput = benchmark(open_mode, args)
+            sidecars = [
+                suffix
+                for suffix in ["-wal", "-shm"]
+                if os.path.exists(args.db_path + suffix)
+            ]
+            print(
+                f"{open_mode:>10}: {throughput:,.1f} queries/s, "
+                f"sidecar files: {sidecars or 'none'}"
+            )
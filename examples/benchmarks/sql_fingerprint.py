@@ -0,0 +1,82 @@
+"""Cost of canonicalizing and fingerprinting SQL, compared to sqlparse.format.
+
+Usage:
+    python examples/benchmarks/sql_fingerprint.py --predict-json path/to/predict.json
+
+Without --predict-json a set of synthetic BIRD-like queries is used.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import sqlparse
+
+from premsql.sql import canonicalize, fingerprint
+
+TEMPLATES = [
+    "SELECT T1.{col} FROM {table} AS T1 INNER JOIN orders AS T2 ON T1.id = T2.{table}_id "
+    "WHERE T2.amount > {num} AND T1.name = '{word}' ORDER BY T1.{col} DESC LIMIT {num}",
+    "select count(*) from {table} where {col} like '%{word}%' -- count them\n group by {col};",
+    "SELECT CAST(SUM(IIF({col} = '{word}', 1, 0)) AS REAL) * 100 / COUNT({col}) "
+    "FROM {table} WHERE strftime('%Y', date) = '{num}'",
+    "WITH ranked AS (SELECT {col}, ROW_NUMBER() OVER (PARTITION BY {col} ORDER BY id) rn "
+    'FROM "{table}") SELECT * FROM ranked WHERE rn <= {num}',
+]
+
+
+def synthetic_queries(num_queries: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        rng.choice(TEMPLATES).format(
+            table=rng.choice(["users", "schools", "Patients", "frpm"]),
+            col=rng.choice(["name", "County", "`Free Meal Count`", "age"]),
+            word=rng.choice(["Alameda", "Bob", "x", "2020"]),
+            num=rng.randint(1, 5000),
+        )
+        for _ in range(num_queries)
+    ]
+
+
+def time_per_query(func, queries: list[str]) -> float:
+    start_time = time.perf_counter()
+    for sql in queries:
+        func(sql)
+    return (time.perf_counter() - start_time) / len(queries) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--predict-json", type=str, default=None)
+    parser.add_argument("--num-queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.predict_json:
+        with open(args.predict_json, "r") as json_file:
+            responses = json.load(json_file)
+        queries = [response["generated"] for response in responses]
+        queries += [response["SQL"] for response in responses]
+    else:
+        queries = synthetic_queries(args.num_queries)
+
+    canonicalize.cache_clear()
+    results = {
+        "canonicalize (cold)": time_per_query(canonicalize, queries),
+        "fingerprint (cached)": time_per_query(fingerprint, queries),
+    }
+    canonicalize.cache_clear()
+    results["fingerprint (cold)"] = time_per_query(fingerprint, queries)
+    results["fingerprint, literals as ? (cold)"] = time_per_query(
+        lambda sql: fingerprint(sql, parameterize_literals=True), queries
+    )
+    results["sqlparse.format"] = time_per_query(
+        lambda sql: sqlparse.format(sql, keyword_case="upper", strip_comments=True),
+        queries,
+    )
+
+    print(
+        f"{len(queries)} queries, {len({fingerprint(sql) for sql in queries})} distinct"
+    )
+    for name, micros in results.items():
+        print(f"{name:>36}: {micros:8.1f} us / query")
@@ -3,6 +3,8 @@ from typing import Any, Optional
 import pandas as pd
 
 from premsql.executors.base import BaseExecutor
+from premsql.executors.screen import QueryCostScreen
+from premsql.executors.spool import ResultSpooler
 from premsql.generators.base import Text2SQLGeneratorBase
 from premsql.agents.base import AgentBase, ExitWorkerOutput
 from premsql.agents.baseline.workers import (
@@ -31,6 +33,8 @@ class BaseLineAgent(AgentBase):
         exclude_tables: Optional[list] = None,
         auto_filter_tables: Optional[bool] = False,
         route_worker_kwargs: Optional[dict] = {},
+        cost_screen: Optional[QueryCostScreen] = None,
+        spooler: Optional[ResultSpooler] = None,
     ) -> None:
         super().__init__(
             session_name=session_name,
@@ -46,6 +50,8 @@ class BaseLineAgent(AgentBase):
             include_tables=include_tables,
             exclude_tables=exclude_tables,
             auto_filter_tables=auto_filter_tables,
+            cost_screen=cost_screen,
+            spooler=spooler,
         )
         self.analysis_worker = BaseLineAnalyserWorker(generator=specialized_model2)
         self.plotter_worker = BaseLinePlotWorker(
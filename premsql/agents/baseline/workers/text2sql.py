@@ -2,6 +2,8 @@ from textwrap import dedent
 from typing import Literal, Optional
 
 from premsql.executors.base import BaseExecutor
+from premsql.executors.screen import QueryCostScreen
+from premsql.executors.spool import ResultSpooler
 from premsql.generators.base import Text2SQLGeneratorBase
 from premsql.logger import setup_console_logger
 from premsql.agents.base import Text2SQLWorkerBase
@@ -27,6 +29,8 @@ class BaseLineText2SQLWorker(Text2SQLWorkerBase):
         include_tables: Optional[list] = None,
         exclude_tables: Optional[list] = None,
         auto_filter_tables: Optional[bool] = False,
+        cost_screen: Optional[QueryCostScreen] = None,
+        spooler: Optional[ResultSpooler] = None,
     ):
         super().__init__(
             db_connection_uri=db_connection_uri,
@@ -39,6 +43,8 @@ class BaseLineText2SQLWorker(Text2SQLWorkerBase):
         self.corrector = helper_model
         self.table_filer_worker = helper_model
         self.auto_filter_tables = auto_filter_tables
+        self.cost_screen = cost_screen
+        self.spooler = spooler
 
     @staticmethod
     def show_dataframe(output: Text2SQLWorkerOutput):
@@ -155,8 +161,12 @@ class BaseLineText2SQLWorker(Text2SQLWorkerBase):
     ) -> Text2SQLWorkerOutput:
         if question.startswith("`") and question.endswith("`"):
             result = execute_and_render_result(
-                db=self.db, sql=question.replace('`', ''), using=render_results_using
-            ) 
+                db=self.db,
+                sql=question.replace('`', ''),
+                using=render_results_using,
+                cost_screen=self.cost_screen,
+                spooler=self.spooler,
+            )
             return Text2SQLWorkerOutput(
             db_connection_uri=self.db_connection_uri,
             sql_string=question.startswith("`"),
@@ -192,7 +202,11 @@ class BaseLineText2SQLWorker(Text2SQLWorkerBase):
         )
 
         result = execute_and_render_result(
-            db=self.db, sql=generated_sql, using=render_results_using
+            db=self.db,
+            sql=generated_sql,
+            using=render_results_using,
+            cost_screen=self.cost_screen,
+            spooler=self.spooler,
         )
 
         if result["error_from_model"] is not None:
@@ -207,7 +221,11 @@ class BaseLineText2SQLWorker(Text2SQLWorkerBase):
                 **kwargs,
             )
             result = execute_and_render_result(
-                db=self.db, sql=generated_sql, using=render_results_using
+                db=self.db,
+                sql=generated_sql,
+                using=render_results_using,
+                cost_screen=self.cost_screen,
+                spooler=self.spooler,
             )
 
         return Text2SQLWorkerOutput(
@@ -21,7 +21,8 @@ class AgentInteractionMemory:
 
         logger.info(self.db_path)
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        self.conn = sqlite3.connect(self.db_path)
+        # The agent server runs the agent in worker threads
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.create_table_if_not_exists()
 
 
@@ -1,8 +1,10 @@
-from typing import Any, Dict, Literal
+from typing import Any, Dict, Literal, Optional
 
 import pandas as pd
 
 from premsql.executors.from_langchain import SQLDatabase
+from premsql.executors.screen import QueryCostScreen
+from premsql.executors.spool import ResultSpooler
 from premsql.logger import setup_console_logger
 from premsql.agents.models import AgentOutput, ExitWorkerOutput
 
@@ -14,13 +16,24 @@ def convert_df_to_dict(df: pd.DataFrame):
 
 
 def execute_and_render_result(
-    db: SQLDatabase, sql: str, using: Literal["dataframe", "json"]
+    db: SQLDatabase,
+    sql: str,
+    using: Literal["dataframe", "json"],
+    cost_screen: Optional[QueryCostScreen] = None,
+    spooler: Optional[ResultSpooler] = None,
 ):
-    result = db.run_no_throw(command=sql, fetch="cursor")
+    sql_to_run, screened = sql, None
+    if cost_screen is not None:
+        screened = cost_screen.screen_engine(engine=db._engine, sql=sql)
+        if screened["error"] is not None:
+            return _render_error(screened["error"], sql, using)
+        sql_to_run = screened["sql"]
+
+    result = db.run_no_throw(command=sql_to_run, fetch="cursor")
 
     if isinstance(result, str):
         return _render_error(result, sql, using)
-    return _render_data(result, sql, using)
+    return _render_data(result, sql, using, spooler=spooler, screened=screened)
 
 
 def _render_error(error: str, sql: str, using: str) -> Dict[str, Any]:
@@ -33,12 +46,43 @@ def _render_error(error: str, sql: str, using: str) -> Dict[str, Any]:
     return to_show
 
 
-def _render_data(result, sql: str, using: str) -> Dict[str, Any]:
-    table = pd.DataFrame(data=result.fetchall(), columns=result.keys())
-    if len(table) > 200:
-        logger.info("Truncating output table to first 200 rows only")
-        table = table.iloc[:200, :]
-    
+def _spool_rest(result, rows: list, spooler: ResultSpooler, chunk_size: int = 10000):
+    """Spools the rows already fetched and the rest of the cursor to disk"""
+
+    def chunks():
+        yield rows
+        while True:
+            chunk = result.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    return spooler.spool(chunks=chunks(), columns=list(result.keys()))
+
+
+def _render_data(
+    result,
+    sql: str,
+    using: str,
+    max_rows: Optional[int] = 200,
+    spooler: Optional[ResultSpooler] = None,
+    screened: Optional[dict] = None,
+) -> Dict[str, Any]:
+    # Only fetch the rows which are shown, plus one to detect truncation
+    rows = result.fetchmany(max_rows + 1)
+    spooled = None
+    if len(rows) > max_rows:
+        if spooler is not None:
+            # The full result goes to disk, only the shown rows stay in memory
+            try:
+                spooled = _spool_rest(result, rows, spooler)
+            except ValueError as e:
+                logger.info(f"Could not spool the full result: {e}")
+        logger.info(f"Truncating output table to first {max_rows} rows only")
+        rows = rows[:max_rows]
+    result.close()
+    table = pd.DataFrame(data=rows, columns=list(result.keys()))
+
     if any(table.columns.duplicated()):
         logger.info(f"Found duplicate columns: {table.columns[table.columns.duplicated()].tolist()}")
         # Create unique column names by adding suffixes
@@ -47,9 +91,22 @@ def _render_data(result, sql: str, using: str) -> Dict[str, Any]:
         logger.info(f"Renamed columns to: {table.columns.tolist()}")
 
     to_show = {"sql_string": sql, "error_from_model": None, "dataframe": table}
+    if spooled is not None:
+        to_show["spooled_result"] = spooled
+        table.attrs["spooled_result"] = spooled.to_dict()
+    if screened is not None and screened["action"] == "limit":
+        # The cost screen limited the query, the rows shown may be cut short
+        logger.info(f"The query was limited by the cost screen: {screened['sql']}")
+        to_show["screen"] = screened
+        table.attrs["screen"] = screened
 
     if using == "json":
         to_show["dataframe"] = {"columns": list(table.columns), "data": table.to_dict()}
+        if spooled is not None:
+            # Reopened with SpooledResult.open(path) to page through or export
+            to_show["dataframe"]["spooled_result"] = spooled.to_dict()
+        if "screen" in to_show:
+            to_show["dataframe"]["screen"] = screened
     return to_show
 
 
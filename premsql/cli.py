@@ -105,5 +105,159 @@ def stop():
         click.echo(f"Error stopping services: {e}", err=True)
         sys.exit(1)
 
+@cli.group()
+def cache():
+    """Manage the on-disk gold result cache"""
+    pass
+
+
+@cache.command(name="warm")
+@click.option("--dataset-path", required=True, help="Folder of the dataset split")
+@click.option("--json-file", default="validation.json", help="Dataset json file name")
+@click.option("--database-folder", default="dev_databases", help="Databases folder name")
+@click.option(
+    "--executor",
+    type=click.Choice(["sqlite", "optimized"]),
+    default="sqlite",
+    help="Executor the cache is warmed for",
+)
+@click.option("--cache-dir", default=None, help="Directory of the gold result cache")
+@click.option("--max-size-mb", default=1024.0, help="Maximum size of the cache in MB")
+def cache_warm(dataset_path, json_file, database_folder, executor, cache_dir, max_size_mb):
+    """Pre-compute gold results for a whole dataset split"""
+    import json
+
+    from tqdm.auto import tqdm
+
+    from premsql.executors import OptimizedSQLiteExecutor, SQLiteExecutor
+    from premsql.executors.cache import GoldResultCache
+
+    dataset_path = Path(dataset_path)
+    json_path = dataset_path / json_file
+    if not json_path.exists():
+        click.echo(f"Error: dataset json not found at {json_path}", err=True)
+        sys.exit(1)
+
+    with open(json_path, "r") as file:
+        dataset = json.load(file)
+
+    gold_cache = GoldResultCache(cache_dir=cache_dir, max_size_mb=max_size_mb)
+    executor_cls = SQLiteExecutor if executor == "sqlite" else OptimizedSQLiteExecutor
+    sql_executor = executor_cls(gold_cache=gold_cache)
+
+    num_errors = 0
+    for content in tqdm(dataset, total=len(dataset), desc="Warming gold cache"):
+        db_path = content.get("db_path") or str(
+            dataset_path / database_folder / content["db_id"] / f"{content['db_id']}.sqlite"
+        )
+        result = sql_executor.digest_gold_sql(gold_sql=content["SQL"], dsn_or_db_path=db_path)
+        num_errors += int(result["error"] is not None)
+
+    sql_executor.close()
+    stats = gold_cache.stats
+    click.echo(
+        f"Cached {stats['entries']} gold results ({stats['size_mb']:.2f} MB), "
+        f"{num_errors} gold queries failed"
+    )
+
+
+@cache.command(name="info")
+@click.option("--cache-dir", default=None, help="Directory of the gold result cache")
+def cache_info(cache_dir):
+    """Show the size of the gold result cache"""
+    from premsql.executors.cache import GoldResultCache
+
+    gold_cache = GoldResultCache(cache_dir=cache_dir)
+    stats = gold_cache.stats
+    click.echo(f"Cache: {gold_cache.db_path}")
+    click.echo(f"Entries: {stats['entries']}, size: {stats['size_mb']:.2f} MB")
+
+
+@cache.command(name="clear")
+@click.option("--cache-dir", default=None, help="Directory of the gold result cache")
+def cache_clear(cache_dir):
+    """Remove every entry of the gold result cache"""
+    from premsql.executors.cache import GoldResultCache
+
+    GoldResultCache(cache_dir=cache_dir).clear()
+    click.echo("Gold result cache cleared.")
+
+
+
+@cli.group()
+def index():
+    """Recommend sqlite indexes for a query workload"""
+    pass
+
+
+@index.command(name="advise")
+@click.option("--predict-json", default=None, help="predict.json of an evaluation run")
+@click.option("--sql-key", default="generated", help="Key of the SQL in predict.json")
+@click.option("--include-gold", is_flag=True, help="Also replay the gold SQL")
+@click.option("--session-name", default=None, help="Agent session to take queries from")
+@click.option("--memory-db", default=None, help="Agent memory database of the session")
+@click.option("--num-iterations", default=5, help="Timed runs per query and index")
+@click.option("--max-candidates", default=20, help="Candidate indexes per database")
+@click.option("--top", default=5, help="Recommendations shown per database")
+@click.option("--output", default=None, help="Write the full report to this json file")
+def index_advise(
+    predict_json,
+    sql_key,
+    include_gold,
+    session_name,
+    memory_db,
+    num_iterations,
+    max_candidates,
+    top,
+    output,
+):
+    """Build candidate indexes on scratch copies and measure their speedup"""
+    import json
+
+    from premsql.executors.index_advisor import IndexAdvisor
+
+    workload = []
+    if predict_json:
+        workload += IndexAdvisor.workload_from_json(
+            predict_json, sql_key=sql_key, include_gold=include_gold
+        )
+    if session_name:
+        from premsql.agents.memory import AgentInteractionMemory
+
+        memory = AgentInteractionMemory(session_name=session_name, db_path=memory_db)
+        workload += IndexAdvisor.workload_from_history(memory)
+        memory.close()
+    if not workload:
+        click.echo("Error: pass --predict-json and/or --session-name", err=True)
+        sys.exit(1)
+
+    advisor = IndexAdvisor(num_iterations=num_iterations, max_candidates=max_candidates)
+    reports = advisor.advise(workload)
+
+    for report in reports:
+        click.echo(
+            f"\n{report['db_path']}: {report['num_queries']} queries, "
+            f"{len(report['failed_queries'])} failed, "
+            f"{len(report['skipped_queries'])} skipped (not read-only)"
+        )
+        if report.get("error"):
+            click.echo(f"  {report['error']}")
+        useful = [r for r in report["recommendations"] if r["time_saved"] > 0]
+        if not useful:
+            click.echo("  No index makes this workload faster")
+        for recommendation in useful[:top]:
+            click.echo(
+                f"  {recommendation['sql']}\n"
+                f"    {recommendation['speedup']:.2f}x on "
+                f"{recommendation['num_queries_using']} queries, "
+                f"saves {recommendation['time_saved'] * 1000:.1f} ms per replay, "
+                f"{recommendation['size_bytes'] / (1024 * 1024):.2f} MB on disk"
+            )
+
+    if output:
+        with open(output, "w") as json_file:
+            json.dump(reports, json_file, indent=4)
+        click.echo(f"\nFull report written to {output}")
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -13,6 +13,7 @@ from premsql.evaluator.base import BaseExecutor, Text2SQLEvaluator
 from premsql.generators.base import Text2SQLGeneratorBase
 from premsql.logger import setup_console_logger
 from premsql.prompts import ERROR_HANDLING_PROMPT
+from premsql.records import ExperimentRecords, find_records
 
 logger = setup_console_logger("[ERROR-HANDLING-DATASET]")
 
@@ -116,8 +117,9 @@ class ErrorDatasetGenerator:
         del responses
 
         # Now iterate over the error dataset
-        with open(self.generator.experiment_path / "predict.json", "r") as file:
-            error_dataset = json.load(file)
+        error_dataset = ExperimentRecords(
+            find_records(self.generator.experiment_path, "predict")
+        ).to_list()
 
         error_instances = ErrorDatasetInstance(dataset=error_dataset).apply_prompt(
             prompt_template=prompt_template
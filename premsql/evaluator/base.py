@@ -1,14 +1,78 @@
 import math
+import multiprocessing
 import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Literal, Optional, Union
 
+import numpy as np
+import pandas as pd
 from func_timeout import FunctionTimedOut, func_timeout
 from tqdm.auto import tqdm
 
-from premsql.executors.base import BaseExecutor
+from premsql.evaluator.journal import EvaluationJournal
+from premsql.executors.base import BaseExecutor, group_by_database
+from premsql.executors.metrics import MetricsCollector
+from premsql.logger import setup_console_logger
+from premsql.records import ExperimentRecords, ExperimentWriter, records_path
+from premsql.sql import fingerprint
 from premsql.utils import save_to_json
 
+logger = setup_console_logger(name="[EVALUATOR]")
+
+
+def _to_python(value):
+    """Turns a group key from pandas into a JSON serializable value"""
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# Evaluator of a worker process of the parallel evaluation
+_worker_evaluator: Optional["Text2SQLEvaluator"] = None
+
+
+def _init_worker(executor: BaseExecutor, experiment_path: Path) -> None:
+    global _worker_evaluator
+    _worker_evaluator = Text2SQLEvaluator(
+        executor=executor, experiment_path=experiment_path
+    )
+
+
+def _evaluate_chunk(
+    dsn_or_db_path: str,
+    indexed_responses: list[tuple[int, dict, bool]],
+    kwargs: dict,
+) -> tuple[list[tuple[int, dict]], Optional[dict], Optional[MetricsCollector]]:
+    """Evaluates responses of one database in a worker process.
+
+    `indexed_responses` holds the position of every response, the response
+    and whether it matches its gold SQL canonically. Returns the results
+    with their positions, along with the interrupt stats and metrics of the
+    chunk so that they can be merged by the parent.
+    """
+    executor = _worker_evaluator.executor
+    if executor.supports_interrupt:
+        executor.reset_interrupt_stats()
+    if executor.metrics is not None:
+        executor.metrics.reset()
+
+    results = []
+    with executor.session(dsn_or_db_path):
+        for index, response, canonical_match in indexed_responses:
+            result = _worker_evaluator._evaluate_response(
+                response=response,
+                dsn_or_db_path=response["db_path"],
+                canonical_match=canonical_match,
+                model_kwargs=kwargs,
+            )
+            results.append((index, result))
+
+    interrupt_stats = (
+        dict(executor.interrupt_stats) if executor.supports_interrupt else None
+    )
+    return results, interrupt_stats, executor.metrics
+
 
 class Text2SQLEvaluator:
     def __init__(
@@ -16,6 +80,7 @@ class Text2SQLEvaluator:
     ) -> None:
         self.executor = executor
         self.experiment_path = Path(experiment_path)
+        self.execution_stats = {}
 
     def _execute_model(
         self,
@@ -28,6 +93,17 @@ class Text2SQLEvaluator:
         debug: Optional[bool] = False,
     ):
         assert metric_name in ["accuracy", "ves"], "Invalid metric name"
+        if self.executor.supports_interrupt:
+            return self._execute_model_with_deadline(
+                metric_name=metric_name,
+                generated_sql=generated_sql,
+                gold_sql=gold_sql,
+                dsn_or_db_path=dsn_or_db_path,
+                meta_time_out=meta_time_out,
+                num_iterations=num_iterations,
+                debug=debug,
+            )
+
         try:
             if metric_name == "accuracy":
                 result = func_timeout(
@@ -45,10 +121,7 @@ class Text2SQLEvaluator:
             else:
                 raise ValueError(f"Invalid metric name: {metric_name}")
 
-            return {
-                metric_name: result["result"],
-                "error": result["error"],
-            }
+            return self._to_model_result(metric_name=metric_name, result=result)
         except FunctionTimedOut as e:
             return {
                 metric_name: 0,
@@ -63,81 +136,491 @@ class Text2SQLEvaluator:
                 "error": f"Exception: {e}",
             }
 
+    def _execute_model_with_deadline(
+        self,
+        metric_name: str,
+        generated_sql: str,
+        gold_sql: str,
+        dsn_or_db_path: str,
+        meta_time_out: Optional[int] = 1000,
+        num_iterations: Optional[int] = None,
+        debug: Optional[bool] = False,
+    ):
+        # The executor stops the running query itself once the deadline is
+        # crossed, so no watchdog thread is needed here.
+        try:
+            with self.executor.deadline(meta_time_out) as deadline:
+                if metric_name == "accuracy":
+                    result = self.executor.match_sqls(
+                        generated_sql, gold_sql, dsn_or_db_path
+                    )
+                else:
+                    num_iterations = 10 if num_iterations is None else num_iterations
+                    result = self.executor.iterated_execution(
+                        generated_sql, gold_sql, dsn_or_db_path, num_iterations
+                    )
+        except Exception as e:
+            if debug:
+                traceback.print_exc()
+
+            return {
+                metric_name: 0,
+                "error": f"Exception: {e}",
+            }
+
+        if deadline["interrupted"]:
+            return {
+                metric_name: 0,
+                "error": f"Query interrupted: exceeded the timeout of {meta_time_out}s",
+            }
+        return self._to_model_result(metric_name=metric_name, result=result)
+
+    @staticmethod
+    def _to_model_result(metric_name: str, result: dict) -> dict:
+        model_result = {
+            metric_name: result["result"],
+            "error": result["error"],
+        }
+        if "timing" in result:
+            model_result["timing"] = result["timing"]
+        return model_result
+
     def execute(
         self,
         metric_name: str,
-        model_responses: list[dict],
-        filter_by: Optional[str] = None,
+        model_responses: Union[list[dict], ExperimentRecords, str, Path],
+        filter_by: Optional[Union[str, list[str]]] = None,
         num_iterations: Optional[int] = 10,
         meta_time_out: Optional[int] = 10,  # change it later to 1000
         debug: Optional[bool] = False,
+        num_workers: Optional[int] = 1,
+        resume: Optional[bool] = True,
+        output_format: Optional[Literal["json", "jsonl"]] = "json",
+        compression: Optional[Literal["zstd"]] = None,
+        deduplicate: Optional[bool] = True,
     ) -> dict:
-        data_with_results = []
+        """Evaluates the model responses and saves the results.
 
-        for response in tqdm(model_responses, total=len(model_responses)):
-            result = self._execute_model(
-                metric_name=metric_name,
-                generated_sql=response["generated"],
-                gold_sql=response["SQL"],
-                dsn_or_db_path=response["db_path"],
-                num_iterations=num_iterations,
-                meta_time_out=meta_time_out,
-                debug=debug,
+        `model_responses` is a list of responses or an experiment file
+        (`ExperimentRecords` or its path, e.g. a predict.jsonl.zst). Records
+        read from a file are not held in memory: only the fields needed for
+        the evaluation are kept, and the records are streamed again when the
+        results are written. The results are streamed to predict.json, or to
+        predict.jsonl with `output_format="jsonl"` (zstd compressed with
+        `compression="zstd"`).
+
+        Every result is appended to `<metric_name>_journal.jsonl` in the
+        experiment path as soon as it is computed. With `resume`, a run on
+        the same experiment path reuses the journaled results of unchanged
+        responses and only evaluates the others; otherwise the journal is
+        started afresh. Results are not reused once the timeout, number of
+        iterations, executor, comparator or database file changed.
+
+        With `num_workers` greater than 1 the responses are evaluated by a
+        pool of processes, each receiving a copy of the executor. Responses
+        are sent in chunks of a single database to keep its connections and
+        caches warm, and the results keep the input order. Note that VES
+        timings are then measured while other queries run in parallel. Like
+        any multiprocessing code, scripts using it need an
+        `if __name__ == "__main__":` guard.
+
+        `filter_by` breaks the metric down by a key of the responses, or by
+        a list of keys (e.g. `["difficulty", "db_id"]`), see `aggregate`.
+
+        With `deduplicate`, responses with the same database, generated and
+        gold SQL are executed once and share the result, and responses whose
+        generated SQL only differs from the gold SQL in whitespace, comments
+        and keyword case (quoted tokens and identifiers are compared as
+        written) are scored as a match once the gold SQL ran without an
+        error, without running the generated SQL. The work avoided is
+        reported in `execution_stats`.
+        """
+        filter_keys = (
+            [filter_by] if isinstance(filter_by, str) else list(filter_by or [])
+        )
+        source = model_responses
+        if not isinstance(model_responses, list):
+            if not isinstance(model_responses, ExperimentRecords):
+                source = ExperimentRecords(model_responses)
+            keys = ["db_path", "generated", "SQL"] + filter_keys
+            model_responses = [
+                {key: record[key] for key in keys if key in record} for record in source
+            ]
+
+        results = [None] * len(model_responses)
+        if self.executor.supports_interrupt:
+            self.executor.reset_interrupt_stats()
+        if self.executor.metrics is not None:
+            self.executor.metrics.reset()
+
+        # Journaled results are only reused when evaluated the same way
+        executor_class = type(self.executor)
+        comparator = getattr(self.executor, "comparator", None)
+        journal = EvaluationJournal(
+            self.experiment_path / f"{metric_name}_journal.jsonl",
+            settings={
+                "meta_time_out": meta_time_out,
+                "num_iterations": num_iterations if metric_name == "ves" else None,
+                "executor": f"{executor_class.__module__}.{executor_class.__qualname__}",
+                "comparator": getattr(comparator, "name", None),
+                "deduplicate": deduplicate,
+            },
+        )
+        if not resume:
+            journal.clear()
+        completed = journal.load(
+            metric_name=metric_name, model_responses=model_responses
+        )
+        if completed:
+            logger.info(
+                f"Resuming from the journal: {len(completed)} of "
+                f"{len(model_responses)} responses are already evaluated"
             )
-            data_with_results.append({**response, **result})
+        for index, result in completed.items():
+            results[index] = result
+        pending = [
+            index for index in range(len(model_responses)) if index not in completed
+        ]
 
-        execution_result = {}
-        if filter_by:
-            if filter_by not in data_with_results[0]:
-                raise KeyError(f"Filter key: {filter_by} is not found in responses")
-
-            filter_values = {response[filter_by] for response in data_with_results}
-            total_responses = len(data_with_results)
-            overall_metric = 0.0
-
-            for value in filter_values:
-                filtered_responses = [
-                    response
-                    for response in data_with_results
-                    if response[filter_by] == value
-                ]
-                metric_value = self.compute_metric(
-                    results=filtered_responses, metric_name=metric_name
-                )
-                execution_result[value] = metric_value
-                overall_metric += (
-                    metric_value * len(filtered_responses) / total_responses
+        matched, duplicates = set(), {}
+        if deduplicate:
+            pending, matched, duplicates = self._deduplicate(
+                model_responses=model_responses, indices=pending
+            )
+
+        def on_result(index: int, result: dict) -> None:
+            for position in [index] + duplicates.get(index, []):
+                results[position] = dict(result)
+                journal.append(
+                    index=position,
+                    key=journal.make_key(metric_name, model_responses[position]),
+                    result=results[position],
                 )
+            if duplicates.get(index):
+                progress_bar.update(len(duplicates[index]))
 
-            execution_result["overall"] = overall_metric
-        else:
-            execution_result["overall"] = self.compute_metric(
-                results=data_with_results, metric_name=metric_name
-            )
+        model_kwargs = {
+            "metric_name": metric_name,
+            "num_iterations": num_iterations,
+            "meta_time_out": meta_time_out,
+            "debug": debug,
+        }
+        progress_bar = tqdm(total=len(model_responses), initial=len(completed))
+        try:
+            if num_workers > 1 and pending:
+                self._execute_parallel(
+                    model_responses=model_responses,
+                    indices=pending,
+                    matched=matched,
+                    num_workers=num_workers,
+                    model_kwargs=model_kwargs,
+                    on_result=on_result,
+                    progress_bar=progress_bar,
+                )
+            else:
+                self._execute_serial(
+                    model_responses=model_responses,
+                    indices=pending,
+                    matched=matched,
+                    model_kwargs=model_kwargs,
+                    on_result=on_result,
+                    progress_bar=progress_bar,
+                )
+        finally:
+            progress_bar.close()
+            journal.close()
 
+        execution_result = self.aggregate(
+            metric_name=metric_name,
+            model_responses=model_responses,
+            results=results,
+            filter_by=filter_by,
+        )
         save_to_json(
             json_object=execution_result,
             save_path=self.experiment_path / f"{metric_name}.json",
         )
 
-        # also save the data_with_results
-        save_to_json(
-            json_object=data_with_results,
-            save_path=self.experiment_path / "predict.json",
+        # also save the responses with their results
+        predict_path = records_path(
+            self.experiment_path,
+            "predict",
+            format=output_format,
+            compression=compression,
         )
+        with ExperimentWriter(predict_path) as writer:
+            for index, response in enumerate(source):
+                writer.write({**response, **results[index]})
+
+        self.execution_stats = {}
+        if deduplicate:
+            canonical_matches = sum(
+                1 for index in matched if results[index].get("canonical_match")
+            )
+            self.execution_stats.update(
+                {
+                    "executed_responses": len(pending) - canonical_matches,
+                    "duplicate_responses": sum(map(len, duplicates.values())),
+                    "canonical_matches": canonical_matches,
+                }
+            )
+            logger.info(
+                f"Executed {len(pending) - canonical_matches} responses, skipped "
+                f"{self.execution_stats['duplicate_responses']} duplicates and "
+                f"{canonical_matches} canonical matches of the gold SQL"
+            )
+        if self.executor.supports_interrupt:
+            self.execution_stats.update(self.executor.interrupt_stats)
+            logger.info(
+                f"Interrupted {self.execution_stats['interrupted_queries']} queries "
+                "which crossed the timeout"
+            )
+        if self.execution_stats:
+            save_to_json(
+                json_object=self.execution_stats,
+                save_path=self.experiment_path / f"{metric_name}_execution_stats.json",
+            )
+        if self.executor.metrics is not None:
+            metrics_path = self.experiment_path / f"{metric_name}_metrics.json"
+            self.executor.metrics.dump(metrics_path)
+            logger.info(f"Saved query metrics in: {metrics_path}")
         return execution_result
 
-    def compute_metric(self, results: list[dict], metric_name: str) -> float:
-        if metric_name == "accuracy":
-            return sum(res["accuracy"] for res in results) / len(results) * 100
+    @staticmethod
+    def _deduplicate(
+        model_responses: list[dict], indices: list[int]
+    ) -> tuple[list[int], set[int], dict[int, list[int]]]:
+        """Splits the responses at `indices` into the ones to evaluate, with
+        the set of those matching their gold SQL canonically, and the
+        duplicates sharing the result of the first response with the same
+        (db_path, generated, SQL).
+        """
+        to_execute, matched, duplicates, first_of = [], set(), {}, {}
+        for index in indices:
+            response = model_responses[index]
+            triple = (str(response["db_path"]), response["generated"], response["SQL"])
+            if triple in first_of:
+                duplicates.setdefault(first_of[triple], []).append(index)
+                continue
+            first_of[triple] = index
 
-        elif metric_name == "ves":
-            num_queries = len(results)
-            total_ratio = 0.0
-            for result in results:
-                total_ratio += math.sqrt(result["ves"]) * 100
-            ves = total_ratio / num_queries
-            return ves
+            to_execute.append(index)
+            generated, gold = response["generated"], response["SQL"]
+            # Identifiers keep their case: they are case sensitive in some
+            # databases, and a double quoted one can be a string in SQLite
+            if (
+                isinstance(generated, str)
+                and isinstance(gold, str)
+                and fingerprint(generated, lowercase_identifiers=False)
+                == fingerprint(gold, lowercase_identifiers=False)
+            ):
+                matched.add(index)
+        return to_execute, matched, duplicates
+
+    def _gold_runs(
+        self, gold_sql: str, dsn_or_db_path: str, meta_time_out: Optional[int]
+    ) -> bool:
+        """Whether the gold SQL runs without an error within the timeout"""
+        try:
+            if self.executor.supports_interrupt:
+                with self.executor.deadline(meta_time_out) as deadline:
+                    result = self.executor.digest_gold_sql(gold_sql, dsn_or_db_path)
+                return not deadline["interrupted"] and result["error"] is None
+            result = func_timeout(
+                meta_time_out,
+                self.executor.digest_gold_sql,
+                args=(gold_sql, dsn_or_db_path),
+            )
+            return result["error"] is None
+        except (FunctionTimedOut, Exception):
+            return False
+
+    def _evaluate_response(
+        self,
+        response: dict,
+        dsn_or_db_path: str,
+        canonical_match: bool,
+        model_kwargs: dict,
+    ) -> dict:
+        # A canonical match only needs the gold SQL to run, its result (and
+        # its digest in the gold cache) is the one of the generated SQL
+        if canonical_match and self._gold_runs(
+            gold_sql=response["SQL"],
+            dsn_or_db_path=dsn_or_db_path,
+            meta_time_out=model_kwargs["meta_time_out"],
+        ):
+            return {
+                model_kwargs["metric_name"]: 1,
+                "error": None,
+                "canonical_match": True,
+            }
+        return self._execute_model(
+            generated_sql=response["generated"],
+            gold_sql=response["SQL"],
+            dsn_or_db_path=dsn_or_db_path,
+            **model_kwargs,
+        )
+
+    def _execute_serial(
+        self,
+        model_responses: list[dict],
+        indices: list[int],
+        matched: set[int],
+        model_kwargs: dict,
+        on_result: Callable[[int, dict], None],
+        progress_bar: tqdm,
+    ) -> None:
+        # Responses are executed one database at a time so that each database
+        # is opened and warmed once.
+        groups = group_by_database([model_responses[i]["db_path"] for i in indices])
+        for dsn_or_db_path, positions in groups.items():
+            with self.executor.session(dsn_or_db_path):
+                for position in positions:
+                    index = indices[position]
+                    result = self._evaluate_response(
+                        response=model_responses[index],
+                        dsn_or_db_path=model_responses[index]["db_path"],
+                        canonical_match=index in matched,
+                        model_kwargs=model_kwargs,
+                    )
+                    on_result(index, result)
+                    progress_bar.update(1)
 
+    def _execute_parallel(
+        self,
+        model_responses: list[dict],
+        indices: list[int],
+        matched: set[int],
+        num_workers: int,
+        model_kwargs: dict,
+        on_result: Callable[[int, dict], None],
+        progress_bar: tqdm,
+    ) -> None:
+        groups = group_by_database([model_responses[i]["db_path"] for i in indices])
+        # Big databases are split so that every worker gets a share of them
+        chunk_size = max(1, math.ceil(len(indices) / (num_workers * 4)))
+        chunks = [
+            (
+                dsn_or_db_path,
+                [indices[p] for p in positions[start : start + chunk_size]],
+            )
+            for dsn_or_db_path, positions in groups.items()
+            for start in range(0, len(positions), chunk_size)
+        ]
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn"
+        )
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.executor, self.experiment_path),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _evaluate_chunk,
+                    dsn_or_db_path,
+                    [
+                        (index, model_responses[index], index in matched)
+                        for index in indices
+                    ],
+                    model_kwargs,
+                )
+                for dsn_or_db_path, indices in chunks
+            ]
+            for future in as_completed(futures):
+                chunk_results, interrupt_stats, metrics = future.result()
+                for index, result in chunk_results:
+                    on_result(index, result)
+                if interrupt_stats is not None:
+                    self._merge_interrupt_stats(interrupt_stats)
+                if metrics is not None:
+                    self.executor.metrics.merge(metrics)
+                progress_bar.update(len(chunk_results))
+
+    def _merge_interrupt_stats(self, interrupt_stats: dict) -> None:
+        stats = self.executor.interrupt_stats
+        stats["interrupted_queries"] += interrupt_stats["interrupted_queries"]
+        stats["interrupted_query_time"] += interrupt_stats["interrupted_query_time"]
+        stats["max_interrupt_latency"] = max(
+            stats["max_interrupt_latency"], interrupt_stats["max_interrupt_latency"]
+        )
+
+    @staticmethod
+    def _scores(metric_name: str, values: list) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        if metric_name == "accuracy":
+            return values * 100
+        elif metric_name == "ves":
+            return np.sqrt(values) * 100
         else:
             raise ValueError(f"Invalid metric name: {metric_name}")
+
+    def compute_metric(self, results: list[dict], metric_name: str) -> float:
+        scores = self._scores(metric_name, [res[metric_name] for res in results])
+        return float(scores.mean())
+
+    def aggregate(
+        self,
+        metric_name: str,
+        model_responses: list[dict],
+        results: list[dict],
+        filter_by: Optional[Union[str, list[str]]] = None,
+    ) -> dict:
+        """Computes the overall metric and its breakdown by the `filter_by` keys.
+
+        The keys and per-example scores are put in one DataFrame and grouped
+        once by all the keys together; the breakdown of every single key is
+        summed up from those groups. A single key gives `{value: metric,
+        ..., "overall": metric}`. A list of keys gives the breakdown of every
+        key under its name and, under `"groups"`, one row per combination of
+        values with its count and metric.
+        """
+        scores = self._scores(metric_name, [result[metric_name] for result in results])
+        if not filter_by:
+            return {"overall": float(scores.mean())}
+
+        keys = [filter_by] if isinstance(filter_by, str) else list(filter_by)
+        for key in keys:
+            if key not in model_responses[0]:
+                raise KeyError(f"Filter key: {key} is not found in responses")
+
+        table = pd.DataFrame(
+            {key: [response.get(key) for response in model_responses] for key in keys}
+        )
+        table["score"] = scores
+        groups = (
+            table.groupby(keys, dropna=False, sort=False)["score"]
+            .agg(["sum", "count"])
+            .reset_index()
+        )
+
+        execution_result = {}
+        for key in keys:
+            marginal = groups.groupby(key, dropna=False, sort=False)[
+                ["sum", "count"]
+            ].sum()
+            breakdown = {
+                _to_python(value): float(total / count)
+                for value, total, count in zip(
+                    marginal.index, marginal["sum"], marginal["count"]
+                )
+            }
+            if len(keys) == 1:
+                execution_result.update(breakdown)
+            else:
+                execution_result[key] = breakdown
+
+        if len(keys) > 1:
+            execution_result["groups"] = [
+                {
+                    **{key: _to_python(row[key]) for key in keys},
+                    "count": int(row["count"]),
+                    metric_name: float(row["sum"] / row["count"]),
+                }
+                for row in groups.to_dict(orient="records")
+            ]
+        execution_result["overall"] = float(scores.mean())
+        return execution_result
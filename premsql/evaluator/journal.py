@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+from premsql.executors.pool import resolve_sqlite_path
+from premsql.logger import setup_console_logger
+
+logger = setup_console_logger(name="[EVALUATION-JOURNAL]")
+
+
+class EvaluationJournal:
+    """Append-only JSONL journal of per-example evaluation results.
+
+    Every line holds the position of a response, a key hashing the metric,
+    the evaluation `settings` (timeout, executor, comparator, ...), the
+    database (with the size and modification time of its file) and the
+    generated and gold SQL of that response, and its result. When an
+    evaluation is run again on the same experiment path, the journaled
+    results whose key still matches the response at their position are
+    reused and only the remaining responses are evaluated. A line cut short
+    by a crash is ignored.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        fsync_every: Optional[int] = 50,
+        settings: Optional[dict] = None,
+    ):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.settings = json.dumps(settings or {}, sort_keys=True, default=str)
+        self._file = None
+        self._num_unsynced = 0
+        self._db_identities: dict[str, str] = {}
+
+    def database_identity(self, dsn_or_db_path: str) -> str:
+        """Size and modification time of a database file, empty for a DSN"""
+        dsn_or_db_path = str(dsn_or_db_path)
+        if dsn_or_db_path not in self._db_identities:
+            db_path = resolve_sqlite_path(dsn_or_db_path)
+            identity = ""
+            if os.path.isfile(db_path):
+                stat = os.stat(db_path)
+                identity = f"{stat.st_size}:{stat.st_mtime_ns}"
+            self._db_identities[dsn_or_db_path] = identity
+        return self._db_identities[dsn_or_db_path]
+
+    def make_key(self, metric_name: str, response: dict) -> str:
+        content = json.dumps(
+            [
+                metric_name,
+                self.settings,
+                str(response["db_path"]),
+                self.database_identity(response["db_path"]),
+                response["generated"],
+                response["SQL"],
+            ],
+            ensure_ascii=False,
+        )
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+    def load(self, metric_name: str, model_responses: list[dict]) -> dict[int, dict]:
+        """Returns the journaled results which are valid for these responses"""
+        if not self.path.exists():
+            return {}
+
+        completed = {}
+        with open(self.path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                index = entry.get("index")
+                if not isinstance(index, int) or not 0 <= index < len(model_responses):
+                    continue
+                if entry.get("key") != self.make_key(
+                    metric_name=metric_name, response=model_responses[index]
+                ):
+                    continue
+                completed[index] = entry["result"]
+        return completed
+
+    def append(self, index: int, key: str, result: dict) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a")
+            # A partial last line left by a crash is ended before appending
+            if self._file.tell() > 0:
+                with open(self.path, "rb") as journal_file:
+                    journal_file.seek(-1, os.SEEK_END)
+                    if journal_file.read(1) != b"\n":
+                        self._file.write("\n")
+
+        self._file.write(
+            json.dumps({"index": index, "key": key, "result": result}, ensure_ascii=False)
+            + "\n"
+        )
+        self._file.flush()
+        self._num_unsynced += 1
+        if self.fsync_every is not None and self._num_unsynced >= self.fsync_every:
+            os.fsync(self._file.fileno())
+            self._num_unsynced = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._num_unsynced = 0
+
+    def clear(self) -> None:
+        self.close()
+        if self.path.exists():
+            os.remove(self.path)
@@ -1,4 +1,32 @@
-from premsql.executors.from_langchain import ExecutorUsingLangChain
+from premsql.executors.from_langchain import ExecutorUsingLangChain, SQLDatabaseRegistry
 from premsql.executors.from_sqlite import SQLiteExecutor, OptimizedSQLiteExecutor
+from premsql.executors.from_sqlalchemy import SQLAlchemyExecutor
+from premsql.executors.from_duckdb import DuckDBExecutor
+from premsql.executors.cache import GoldResultCache
+from premsql.executors.metrics import MetricsCollector
+from premsql.executors.plan import QueryPlanInspector
+from premsql.executors.index_advisor import IndexAdvisor
+from premsql.executors.pool import SQLiteConnectionPool
+from premsql.executors.snapshot import SQLiteSnapshotStore
+from premsql.executors.sandbox import SandboxedExecutor
+from premsql.executors.screen import QueryCostScreen
+from premsql.executors.spool import ResultSpooler, SpooledResult
 
-__all__ = ["ExecutorUsingLangChain", "SQLiteExecutor", "OptimizedSQLiteExecutor"]
+__all__ = [
+    "ExecutorUsingLangChain",
+    "SQLiteExecutor",
+    "OptimizedSQLiteExecutor",
+    "SQLAlchemyExecutor",
+    "DuckDBExecutor",
+    "SandboxedExecutor",
+    "QueryCostScreen",
+    "ResultSpooler",
+    "SpooledResult",
+    "SQLiteConnectionPool",
+    "GoldResultCache",
+    "SQLDatabaseRegistry",
+    "QueryPlanInspector",
+    "IndexAdvisor",
+    "SQLiteSnapshotStore",
+    "MetricsCollector",
+]
@@ -1,30 +1,422 @@
+import asyncio
+import functools
+import time
+import weakref
 from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Generator, Iterator, Optional
 
 import numpy as np
 
+from premsql.executors.cache import GoldResultCache
+from premsql.executors.columnar import ColumnarResultBuilder
+from premsql.executors.compare import (
+    ROW_HASH_VERSION,
+    ResultComparator,
+    ResultDigest,
+    normalize_row,
+)
+from premsql.executors.metrics import MetricsCollector, QueryTrace
+from premsql.executors.pool import resolve_sqlite_path
+from premsql.executors.spool import ResultSpooler
+from premsql.executors.timing import TimingHarness
+
+
+class SQLExecutionError(Exception):
+    """Raised while streaming a result when the SQL can not be executed"""
+
+
+class ResultStream:
+    """Iterator over chunks of result rows with the column names, when known"""
+
+    def __init__(
+        self,
+        chunks: Iterator[list],
+        columns: Optional[list[str]] = None,
+        total_rows: Optional[int] = None,
+    ) -> None:
+        self._chunks = iter(chunks)
+        self.columns = columns
+        self.total_rows = total_rows
+
+    def __iter__(self) -> "ResultStream":
+        return self
+
+    def __next__(self) -> list:
+        return next(self._chunks)
+
+
+class QueryRunner:
+    def __init__(
+        self,
+        run: Callable[[str], int],
+        reset_cache: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.run = run
+        self.reset_cache = reset_cache
+
+
+def database_key(dsn_or_db_path: str) -> str:
+    """Returns one key per database, whichever way its sqlite path is written"""
+    if not isinstance(dsn_or_db_path, str):
+        return str(dsn_or_db_path)
+    if "://" in dsn_or_db_path and not dsn_or_db_path.startswith("sqlite:///"):
+        return dsn_or_db_path
+    return resolve_sqlite_path(dsn_or_db_path)
+
+
+def group_by_database(dsn_or_db_paths: list[str]) -> dict[str, list[int]]:
+    """Groups positions by database, in the order each database first appears.
+
+    A sqlite database written both as a path and as a DSN forms one group,
+    keyed by the DSN it first appears with.
+    """
+    groups: dict[str, list[int]] = {}
+    keys: dict[str, str] = {}
+    for index, dsn_or_db_path in enumerate(dsn_or_db_paths):
+        first = keys.setdefault(database_key(dsn_or_db_path), dsn_or_db_path)
+        groups.setdefault(first, []).append(index)
+    return groups
+
 
 class BaseExecutor(ABC):
+    gold_cache: Optional[GoldResultCache] = None
+    metrics: Optional[MetricsCollector] = None
+    comparator: ResultComparator = ResultComparator()
+    timing_harness: TimingHarness = TimingHarness()
+    # Executors which can stop a running query implement a
+    # `deadline(seconds)` context manager and set this flag.
+    supports_interrupt: bool = False
+    # Maximum number of queries running at the same time against one
+    # database through the async API.
+    max_concurrency_per_db: int = 4
+
     @abstractmethod
     def execute_sql(self, sql: str, dsn_or_db_path: str) -> dict:
         return {"result": None, "execution_time": None, "error": None}
 
+    async def execute_sql_async(self, sql: str, dsn_or_db_path: str) -> dict:
+        return await self._run_async(
+            dsn_or_db_path, self.execute_sql, sql=sql, dsn_or_db_path=dsn_or_db_path
+        )
+
+    async def match_sqls_async(
+        self, predicted_sql: str, gold_sql: str, dsn_or_db_path: str
+    ) -> dict:
+        return await self._run_async(
+            dsn_or_db_path,
+            self.match_sqls,
+            predicted_sql=predicted_sql,
+            gold_sql=gold_sql,
+            dsn_or_db_path=dsn_or_db_path,
+        )
+
+    async def _run_async(
+        self, dsn_or_db_path: str, func: Callable[..., Any], /, **kwargs
+    ) -> Any:
+        """Runs a blocking executor method in the default thread pool.
+
+        When the awaiting task is cancelled the query keeps running in its
+        thread; executors which can stop a query override this method.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._async_semaphore(dsn_or_db_path):
+            return await loop.run_in_executor(None, functools.partial(func, **kwargs))
+
+    def _async_semaphore(self, dsn_or_db_path: str) -> asyncio.Semaphore:
+        # Semaphores are bound to the event loop they are used in
+        if "_async_semaphores" not in self.__dict__:
+            self._async_semaphores = weakref.WeakKeyDictionary()
+        loop_semaphores = self._async_semaphores.setdefault(
+            asyncio.get_running_loop(), {}
+        )
+        key = database_key(dsn_or_db_path)
+        if key not in loop_semaphores:
+            loop_semaphores[key] = asyncio.Semaphore(self.max_concurrency_per_db)
+        return loop_semaphores[key]
+
+    def close(self) -> None:
+        """Releases any connection or resource held by the executor"""
+        pass
+
+    def __getstate__(self) -> dict:
+        # Executors are pickled to run in evaluation worker processes, without
+        # the connections, locks and event loop state of this process
+        state = self.__dict__.copy()
+        state.pop("_async_semaphores", None)
+        return state
+
+    @contextmanager
+    def trace(self, dsn_or_db_path: str) -> Generator[QueryTrace, None, None]:
+        """Traces the phases of one query.
+
+        The trace is handed to the metrics collector, when one is set.
+        """
+        trace = QueryTrace(count_bytes=self.metrics is not None)
+        start_time = time.perf_counter()
+        try:
+            yield trace
+        except Exception as e:
+            trace.error = trace.error or str(e)
+            raise
+        finally:
+            trace.record("total", time.perf_counter() - start_time)
+            if self.metrics is not None:
+                self.metrics.record(dsn_or_db_path, trace)
+
+    @contextmanager
+    def session(self, dsn_or_db_path: str) -> Generator[None, None, None]:
+        """Keeps the resources of one database warm across several queries.
+
+        Executors holding connections override it, the default does nothing.
+        """
+        yield
+
+    def execute_many(self, queries: list[tuple[str, str]]) -> dict:
+        """Executes (sql, dsn_or_db_path) pairs grouped by database.
+
+        Every group runs inside one `session`. The results are returned in
+        the input order along with the time spent on each database.
+        """
+        results: list[Optional[dict]] = [None] * len(queries)
+        database_timing = {}
+        groups = group_by_database([dsn_or_db_path for _, dsn_or_db_path in queries])
+
+        for dsn_or_db_path, indices in groups.items():
+            start_time = time.perf_counter()
+            with self.session(dsn_or_db_path):
+                for index in indices:
+                    sql, query_dsn_or_db_path = queries[index]
+                    results[index] = self.execute_sql(
+                        sql=sql, dsn_or_db_path=query_dsn_or_db_path
+                    )
+            database_timing[dsn_or_db_path] = {
+                "num_queries": len(indices),
+                "total_time": time.perf_counter() - start_time,
+            }
+        return {"results": results, "database_timing": database_timing}
+
+    @contextmanager
+    def stream_sql(
+        self, sql: str, dsn_or_db_path: str, chunk_size: Optional[int] = 1000
+    ) -> Generator[ResultStream, None, None]:
+        """Yields a stream over chunks of result rows.
+
+        The default implementation chunks the result of `execute_sql`,
+        executors which can fetch incrementally should override it.
+        """
+        result = self.execute_sql(sql=sql, dsn_or_db_path=dsn_or_db_path)
+        if result["error"]:
+            raise SQLExecutionError(result["error"])
+
+        rows = result["result"]
+        rows = [(rows,)] if isinstance(rows, str) else list(rows or [])
+        columns = list(rows[0].keys()) if rows and isinstance(rows[0], dict) else None
+        yield ResultStream(
+            chunks=(rows[i : i + chunk_size] for i in range(0, len(rows), chunk_size)),
+            columns=columns,
+            total_rows=len(rows),
+        )
+
+    def fetch_columnar(
+        self,
+        sql: str,
+        dsn_or_db_path: str,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        chunk_size: Optional[int] = 1000,
+        count_total: Optional[bool] = False,
+    ) -> dict:
+        """Fetches a result within a row / byte budget as column arrays.
+
+        Rows are fetched chunk by chunk and the fetch stops as soon as the
+        budget is exhausted, in which case `truncated` is set. `total_rows`
+        is exact when the result was not truncated or the executor knows
+        it; otherwise it is counted with an extra query if `count_total`
+        is set, and None if not.
+        """
+        start_time = time.perf_counter()
+        builder = ColumnarResultBuilder(max_rows=max_rows, max_bytes=max_bytes)
+        try:
+            with self.stream_sql(sql, dsn_or_db_path, chunk_size=chunk_size) as stream:
+                for chunk in stream:
+                    if not builder.add(chunk):
+                        break
+                if not builder.truncated and builder.is_full:
+                    builder.truncated = next(stream, None) is not None
+                columns, total_rows = stream.columns, stream.total_rows
+        except SQLExecutionError as e:
+            return {
+                "result": None,
+                "error": str(e),
+                "truncated": False,
+                "num_rows": 0,
+                "total_rows": None,
+                "execution_time": time.perf_counter() - start_time,
+            }
+
+        if not builder.truncated:
+            total_rows = builder.num_rows
+        elif total_rows is None and count_total:
+            count = self.execute_sql(
+                sql=f"SELECT COUNT(*) FROM ({sql.strip().rstrip(';')})",
+                dsn_or_db_path=dsn_or_db_path,
+            )
+            if not count["error"]:
+                total_rows = normalize_row(count["result"][0])[0]
+
+        return {
+            "result": builder.build(columns=columns),
+            "error": None,
+            "truncated": builder.truncated,
+            "num_rows": builder.num_rows,
+            "total_rows": total_rows,
+            "execution_time": time.perf_counter() - start_time,
+        }
+
+    def spool_sql(
+        self,
+        sql: str,
+        dsn_or_db_path: str,
+        spooler: Optional[ResultSpooler] = None,
+        chunk_size: Optional[int] = 10000,
+    ) -> dict:
+        """Spools a result to disk chunk by chunk and returns a `SpooledResult`.
+
+        The full result is never held in memory, which makes it the way to
+        export results too large for `execute_sql` or `fetch_columnar`.
+        """
+        start_time = time.perf_counter()
+        spooler = spooler or ResultSpooler()
+        try:
+            with self.stream_sql(sql, dsn_or_db_path, chunk_size=chunk_size) as stream:
+                spooled = spooler.spool(chunks=stream, columns=stream.columns)
+        except (SQLExecutionError, ValueError) as e:
+            return {
+                "result": None,
+                "error": str(e),
+                "execution_time": time.perf_counter() - start_time,
+            }
+        return {
+            "result": spooled,
+            "error": None,
+            "execution_time": time.perf_counter() - start_time,
+        }
+
+    def _gold_cache_key(self, gold_sql: str, dsn_or_db_path: str) -> Optional[str]:
+        if self.gold_cache is None or not isinstance(dsn_or_db_path, str):
+            return None
+        return self.gold_cache.make_key(
+            gold_sql=gold_sql,
+            dsn_or_db_path=dsn_or_db_path,
+            namespace=f"{self.comparator.name}:v{ROW_HASH_VERSION}",
+        )
+
+    def digest_gold_sql(self, gold_sql: str, dsn_or_db_path: str) -> dict:
+        """Returns the result digest of a gold SQL, using the gold cache when possible"""
+        key = self._gold_cache_key(gold_sql=gold_sql, dsn_or_db_path=dsn_or_db_path)
+        if key is not None:
+            cached = self.gold_cache.get(key)
+            if cached is not None:
+                return {"digest": cached["digest"], "error": None}
+
+        try:
+            with self.stream_sql(
+                gold_sql, dsn_or_db_path, chunk_size=self.comparator.chunk_size
+            ) as gold_chunks:
+                gold_digest = self.comparator.digest(gold_chunks)["digest"]
+        except SQLExecutionError as e:
+            return {"digest": None, "error": str(e)}
+
+        if key is not None:
+            self.gold_cache.put(key, {"digest": gold_digest})
+        return {"digest": gold_digest, "error": None}
+
+    def screen_predicted(self, sql: str, dsn_or_db_path: str) -> Optional[str]:
+        """Returns why a predicted SQL should not be run, None to run it.
+
+        Executors with a cost screen override it to reject queries which are
+        too expensive before `match_sqls` runs them.
+        """
+        return None
+
     def match_sqls(
         self, predicted_sql: str, gold_sql: str, dsn_or_db_path: str
-    ) -> bool:
-        prediction = self.execute_sql(sql=predicted_sql, dsn_or_db_path=dsn_or_db_path)
-        gold = self.execute_sql(sql=gold_sql, dsn_or_db_path=dsn_or_db_path)
-        if prediction["error"]:
+    ) -> dict:
+        start_time = time.perf_counter()
+        gold_digest: Optional[ResultDigest] = None
+
+        rejection = self.screen_predicted(predicted_sql, dsn_or_db_path)
+        if rejection is not None:
+            return {
+                "result": 0,
+                "error": rejection,
+                "execution_time": time.perf_counter() - start_time,
+                "comparison_time": 0.0,
+            }
+
+        key = self._gold_cache_key(gold_sql=gold_sql, dsn_or_db_path=dsn_or_db_path)
+        if key is not None:
+            cached = self.gold_cache.get(key)
+            gold_digest = cached["digest"] if cached is not None else None
+
+        chunk_size = self.comparator.chunk_size
+        try:
+            with ExitStack() as stack:
+                predicted_chunks = stack.enter_context(
+                    self.stream_sql(predicted_sql, dsn_or_db_path, chunk_size=chunk_size)
+                )
+                if gold_digest is not None:
+                    comparison = self.comparator.compare_with_digest(
+                        predicted_chunks, gold_digest
+                    )
+                else:
+                    try:
+                        gold_chunks = stack.enter_context(
+                            self.stream_sql(gold_sql, dsn_or_db_path, chunk_size=chunk_size)
+                        )
+                    except SQLExecutionError as e:
+                        raise SQLExecutionError(f"Error in gold SQL: {e}") from e
+
+                    comparison = self.comparator.compare(predicted_chunks, gold_chunks)
+                    if key is not None and comparison["gold_digest"] is not None:
+                        self.gold_cache.put(key, {"digest": comparison["gold_digest"]})
+        except SQLExecutionError as e:
             return {
                 "result": 0,
-                "error": prediction["error"],
+                "error": str(e),
+                "execution_time": time.perf_counter() - start_time,
+                "comparison_time": 0.0,
             }
 
-        is_match = set(prediction["result"]) == set(gold["result"])
+        total_time = time.perf_counter() - start_time
         return {
-            "result": int(is_match),
-            "error": None if is_match else "Table mismatch",
+            "result": int(comparison["is_match"]),
+            "error": comparison["error"],
+            "execution_time": total_time - comparison["comparison_time"],
+            "comparison_time": comparison["comparison_time"],
         }
 
+    @contextmanager
+    def timed_runner(self, dsn_or_db_path: str) -> Generator["QueryRunner", None, None]:
+        """Yields the runner used by the timing harness for one database.
+
+        The default runner relies on the `execution_time` reported by
+        `execute_sql`; executors which can time a query more precisely
+        (without connection setup) should override it.
+        """
+        yield QueryRunner(
+            run=lambda sql: int(
+                self._checked_execute(sql, dsn_or_db_path)["execution_time"] * 1e9
+            )
+        )
+
+    def _checked_execute(self, sql: str, dsn_or_db_path: str) -> dict:
+        result = self.execute_sql(sql=sql, dsn_or_db_path=dsn_or_db_path)
+        if result["error"]:
+            raise SQLExecutionError(result["error"])
+        return result
+
     def clean_abnormal(self, input: list[float]) -> list[float]:
         input_array = np.asarray(input)
         mean = np.mean(input_array)
@@ -45,18 +437,15 @@ class BaseExecutor(ABC):
         )
 
         if is_match["result"] == 1:
-            diff_list = [
-                self.execute_sql(sql=gold_sql, dsn_or_db_path=dsn_or_db_path)[
-                    "execution_time"
-                ]
-                / self.execute_sql(sql=gold_sql, dsn_or_db_path=dsn_or_db_path)[
-                    "execution_time"
-                ]
-                for _ in range(num_iterations)
-            ]
-            processed_diff_list = self.clean_abnormal(diff_list)
-            return {
-                "result": sum(processed_diff_list) / len(processed_diff_list),
-                "error": None,
-            }
+            try:
+                with self.timed_runner(dsn_or_db_path) as runner:
+                    timing = self.timing_harness.measure(
+                        run_predicted=lambda: runner.run(predicted_sql),
+                        run_gold=lambda: runner.run(gold_sql),
+                        num_iterations=num_iterations,
+                        reset_cache=runner.reset_cache,
+                    )
+            except SQLExecutionError as e:
+                return {"result": 0, "error": str(e)}
+            return {"result": timing["ratio"], "error": None, "timing": timing}
         return {"result": 0, "error": is_match["error"]}
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Literal, Optional, Union
+
+from platformdirs import user_cache_dir
+
+from premsql.executors.pool import resolve_sqlite_path
+from premsql.logger import setup_console_logger
+from premsql.sql import canonicalize
+
+logger = setup_console_logger(name="[GOLD-RESULT-CACHE]")
+
+# Bumped when the key changes, so that entries stored under an older key
+# are never read back
+_KEY_VERSION = 2
+
+
+class GoldResultCache:
+    """On-disk cache of gold SQL execution results.
+
+    Gold queries and benchmark databases do not change between model runs,
+    so the result of a gold query is stored in a small sqlite database keyed
+    by the database file identity and the canonical form of the gold SQL
+    (with quoted tokens and identifiers kept as written). The database
+    identity is either its (path, size, mtime) or the hash of its content.
+    Least recently used entries are evicted once the cache grows beyond
+    `max_size_mb`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_size_mb: Optional[float] = 1024,
+        key_by: Optional[Literal["mtime", "content"]] = "mtime",
+    ) -> None:
+        assert key_by in ["mtime", "content"], "key_by should be mtime or content"
+        self.cache_dir = (
+            Path(cache_dir)
+            if cache_dir is not None
+            else Path(user_cache_dir()) / "premsql" / "gold_cache"
+        )
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "gold_results.db"
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.key_by = key_by
+
+        self._lock = threading.Lock()
+        self._db_identities: dict[tuple, str] = {}
+        self.hits, self.misses = 0, 0
+
+        self._connect()
+
+    def _connect(self) -> None:
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS gold_results (
+                key TEXT PRIMARY KEY,
+                result BLOB,
+                size INTEGER,
+                last_access REAL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def database_identity(self, dsn_or_db_path: str) -> Optional[str]:
+        db_path = resolve_sqlite_path(dsn_or_db_path)
+        if not os.path.isfile(db_path):
+            return None
+
+        stat = os.stat(db_path)
+        file_key = (db_path, stat.st_size, stat.st_mtime_ns)
+        if file_key in self._db_identities:
+            return self._db_identities[file_key]
+
+        if self.key_by == "content":
+            digest = hashlib.blake2b(digest_size=16)
+            with open(db_path, "rb") as db_file:
+                for block in iter(lambda: db_file.read(1 << 20), b""):
+                    digest.update(block)
+            identity = digest.hexdigest()
+        else:
+            identity = "{}:{}:{}".format(*file_key)
+
+        self._db_identities[file_key] = identity
+        return identity
+
+    def make_key(
+        self, gold_sql: str, dsn_or_db_path: str, namespace: Optional[str] = ""
+    ) -> Optional[str]:
+        identity = self.database_identity(dsn_or_db_path)
+        if identity is None:
+            return None
+        return hashlib.sha256(
+            f"{_KEY_VERSION}\x00{namespace}\x00{identity}\x00"
+            f"{canonicalize(gold_sql, lowercase_identifiers=False)}".encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT result FROM gold_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE gold_results SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self.conn.commit()
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key: str, result: dict) -> None:
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_size_bytes:
+            logger.info("Gold result is bigger than the cache size, not caching it")
+            return
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO gold_results VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        total_size = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM gold_results"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        cursor = self.conn.execute(
+            "SELECT key, size FROM gold_results ORDER BY last_access ASC"
+        )
+        to_delete = []
+        for key, size in cursor:
+            if total_size <= self.max_size_bytes:
+                break
+            to_delete.append((key,))
+            total_size -= size
+        self.conn.executemany("DELETE FROM gold_results WHERE key = ?", to_delete)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM gold_results")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            num_entries, total_size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM gold_results"
+            ).fetchone()
+        return {
+            "entries": num_entries,
+            "size_mb": total_size / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def __getstate__(self) -> dict:
+        # Every process opens its own connection to the cache database
+        state = self.__dict__.copy()
+        del state["_lock"], state["conn"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._connect()
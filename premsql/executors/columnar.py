@@ -0,0 +1,84 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+def approximate_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+def to_array(values: list) -> np.ndarray:
+    """Converts a column to a typed NumPy array, falling back to objects"""
+    types = {type(value) for value in values}
+    try:
+        if types and types <= {int, bool}:
+            return np.asarray(values, dtype=np.int64)
+        if types and types <= {int, float, bool, type(None)}:
+            return np.asarray(
+                [np.nan if value is None else value for value in values],
+                dtype=np.float64,
+            )
+    except OverflowError:
+        pass
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class ColumnarResultBuilder:
+    """Accumulates row chunks into columns until a row or byte budget is hit"""
+
+    def __init__(
+        self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.num_rows = 0
+        self.num_bytes = 0
+        self.truncated = False
+        self._columns: list[list] = []
+
+    @property
+    def is_full(self) -> bool:
+        return self.max_rows is not None and self.num_rows >= self.max_rows
+
+    def add(self, rows: Sequence) -> bool:
+        """Adds a chunk of rows, returns False once the budget is exhausted"""
+        for row in rows:
+            if self.is_full:
+                self.truncated = True
+                return False
+
+            row = tuple(row)
+            row_size = sum(approximate_size(value) for value in row)
+            if self.max_bytes is not None and self.num_bytes + row_size > self.max_bytes:
+                self.truncated = True
+                return False
+
+            if not self._columns:
+                self._columns = [[] for _ in row]
+            for column, value in zip(self._columns, row):
+                column.append(value)
+            self.num_rows += 1
+            self.num_bytes += row_size
+        return not self.is_full
+
+    def build(self, columns: Optional[list[str]] = None) -> dict:
+        num_columns = len(columns) if columns else len(self._columns)
+        columns = columns or [f"column_{i}" for i in range(num_columns)]
+        values = self._columns or [[] for _ in range(num_columns)]
+
+        # Duplicated column names get a positional suffix
+        names, seen = [], set()
+        for i, name in enumerate(columns):
+            names.append(f"{name}_{i}" if name in seen else name)
+            seen.add(name)
+
+        return {
+            "columns": names,
+            "data": {name: to_array(column) for name, column in zip(names, values)},
+        }
@@ -0,0 +1,190 @@
+import hashlib
+import time
+from decimal import Decimal
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+# A result digest is (num_rows, lane_a, lane_b): the row count and the
+# wrap-around sums of the two 64 bit halves of every row hash. Sums are
+# order-insensitive and keep track of duplicated rows.
+ResultDigest = tuple[int, int, int]
+
+# Bumped whenever the row normalization changes, digests stored with an
+# older version (e.g. in the gold cache) are not comparable any more
+ROW_HASH_VERSION = 2
+
+
+def _normalize_value(value):
+    # Decimals (NUMERIC columns of DuckDB, Postgres, MySQL) compare equal to
+    # ints and floats but have another repr, so they are hashed as those
+    if isinstance(value, Decimal):
+        if value.is_finite() and value == value.to_integral_value():
+            return int(value)
+        value = float(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def normalize_row(row) -> tuple:
+    if isinstance(row, dict):
+        row = tuple(row.values())
+    elif isinstance(row, (str, bytes)) or not isinstance(row, Iterable):
+        row = (row,)
+    return tuple(_normalize_value(value) for value in row)
+
+
+def hash_rows(rows: Sequence) -> np.ndarray:
+    """Returns a (num_rows, 2) uint64 array with a 128 bit hash per row"""
+    digests = b"".join(
+        hashlib.blake2b(repr(normalize_row(row)).encode(), digest_size=16).digest()
+        for row in rows
+    )
+    return np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+
+
+class ResultComparator:
+    """Streams two results chunk by chunk and compares them as multisets.
+
+    Rows are never kept in memory: every chunk is hashed and folded into an
+    order-insensitive digest. With `distinct=True` the rows are compared as
+    sets (duplicates ignored) which needs to keep one hash per distinct row.
+    """
+
+    def __init__(self, chunk_size: Optional[int] = 1000, distinct: Optional[bool] = False):
+        assert chunk_size > 0, "chunk_size should be greater than 0"
+        self.chunk_size = chunk_size
+        self.distinct = distinct
+
+    @property
+    def name(self) -> str:
+        return "set" if self.distinct else "multiset"
+
+    def digest(self, chunks: Iterator[Sequence]) -> dict:
+        accumulator = _DigestAccumulator(distinct=self.distinct)
+        for chunk in chunks:
+            accumulator.update(chunk)
+        return {
+            "digest": accumulator.result(),
+            "comparison_time": accumulator.hashing_time,
+        }
+
+    def compare(
+        self, predicted_chunks: Iterator[Sequence], gold_chunks: Iterator[Sequence]
+    ) -> dict:
+        """Compares two streams, stopping at the first row count mismatch.
+
+        The returned `gold_digest` is only set when the gold stream has been
+        consumed completely, so that it can be cached.
+        """
+        predicted = _DigestAccumulator(distinct=self.distinct)
+        gold = _DigestAccumulator(distinct=self.distinct)
+
+        if self.distinct:
+            for chunk in predicted_chunks:
+                predicted.update(chunk)
+            for chunk in gold_chunks:
+                gold.update(chunk)
+        else:
+            predicted_chunks, gold_chunks = iter(predicted_chunks), iter(gold_chunks)
+            while True:
+                predicted_chunk = next(predicted_chunks, [])
+                gold_chunk = next(gold_chunks, [])
+                if bool(predicted_chunk) != bool(gold_chunk):
+                    return self._result(
+                        is_match=False,
+                        reason="Row count mismatch",
+                        gold_digest=None,
+                        comparison_time=predicted.hashing_time + gold.hashing_time,
+                    )
+                if not predicted_chunk:
+                    break
+                predicted.update(predicted_chunk)
+                gold.update(gold_chunk)
+
+        predicted_digest, gold_digest = predicted.result(), gold.result()
+        reason = (
+            "Row count mismatch"
+            if predicted_digest[0] != gold_digest[0] and not self.distinct
+            else None
+        )
+        return self._result(
+            is_match=predicted_digest == gold_digest,
+            reason=reason,
+            gold_digest=gold_digest,
+            comparison_time=predicted.hashing_time + gold.hashing_time,
+        )
+
+    def compare_with_digest(
+        self, predicted_chunks: Iterator[Sequence], gold_digest: ResultDigest
+    ) -> dict:
+        predicted = _DigestAccumulator(distinct=self.distinct)
+        for chunk in predicted_chunks:
+            predicted.update(chunk)
+            if not self.distinct and predicted.num_rows > gold_digest[0]:
+                return self._result(
+                    is_match=False,
+                    reason="Row count mismatch",
+                    gold_digest=gold_digest,
+                    comparison_time=predicted.hashing_time,
+                )
+
+        predicted_digest = predicted.result()
+        reason = (
+            "Row count mismatch"
+            if predicted_digest[0] != gold_digest[0] and not self.distinct
+            else None
+        )
+        return self._result(
+            is_match=predicted_digest == tuple(gold_digest),
+            reason=reason,
+            gold_digest=gold_digest,
+            comparison_time=predicted.hashing_time,
+        )
+
+    @staticmethod
+    def _result(
+        is_match: bool,
+        reason: Optional[str],
+        gold_digest: Optional[ResultDigest],
+        comparison_time: float,
+    ) -> dict:
+        return {
+            "is_match": is_match,
+            "error": None if is_match else (reason or "Table mismatch"),
+            "gold_digest": gold_digest,
+            "comparison_time": comparison_time,
+        }
+
+
+class _DigestAccumulator:
+    def __init__(self, distinct: bool) -> None:
+        self.distinct = distinct
+        self.num_rows = 0
+        self.lanes = np.zeros(2, dtype=np.uint64)
+        self.unique_hashes: set[bytes] = set()
+        self.hashing_time = 0.0
+
+    def update(self, rows: Sequence) -> None:
+        if not rows:
+            return
+        start_time = time.perf_counter()
+        hashes = hash_rows(rows)
+        if self.distinct:
+            self.unique_hashes.update(row_hash.tobytes() for row_hash in hashes)
+        else:
+            self.num_rows += len(rows)
+            self.lanes += hashes.sum(axis=0, dtype=np.uint64)
+        self.hashing_time += time.perf_counter() - start_time
+
+    def result(self) -> ResultDigest:
+        if self.distinct:
+            start_time = time.perf_counter()
+            hashes = np.frombuffer(
+                b"".join(sorted(self.unique_hashes)), dtype=np.uint64
+            ).reshape(-1, 2)
+            lanes = hashes.sum(axis=0, dtype=np.uint64)
+            self.hashing_time += time.perf_counter() - start_time
+            return (len(self.unique_hashes), int(lanes[0]), int(lanes[1]))
+        return (self.num_rows, int(self.lanes[0]), int(self.lanes[1]))
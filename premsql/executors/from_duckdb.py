@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator, Iterator, Optional
+
+from premsql.executors.base import (
+    BaseExecutor,
+    QueryRunner,
+    ResultStream,
+    SQLExecutionError,
+)
+from premsql.executors.cache import GoldResultCache
+from premsql.executors.compare import ResultComparator
+from premsql.executors.metrics import MetricsCollector, QueryTrace
+from premsql.executors.timing import TimingHarness
+from premsql.logger import setup_console_logger
+from premsql.utils import convert_sqlite_dsn_to_path
+
+logger = setup_console_logger(name="[DUCKDB-EXEC]")
+
+try:
+    import duckdb
+except ImportError:
+    logger.warn("Ensure duckdb is installed to use the DuckDBExecutor")
+    logger.warn("Install it by: pip install duckdb")
+
+_SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+_FILE_READERS = {
+    ".csv": "read_csv_auto",
+    ".tsv": "read_csv_auto",
+    ".parquet": "read_parquet",
+}
+
+
+def _quote_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _quote_literal(value: str) -> str:
+    return "'{}'".format(value.replace("'", "''"))
+
+
+class DuckDBExecutor(BaseExecutor):
+    """Runs SQL with DuckDB's vectorized engine over existing data.
+
+    `dsn_or_db_path` can point to:
+        - a SQLite database, attached read-only (sqlite extension) and used
+          as the default catalog, so the queries written for the SQLite
+          executors run unchanged.
+        - a DuckDB database file (.duckdb).
+        - a CSV / Parquet file, or a folder of them: every file is exposed
+          as a view named after the file.
+
+    One DuckDB database is kept per source and every query runs on its own
+    cursor, so several results can be streamed at the same time.
+    """
+
+    def __init__(
+        self,
+        threads: Optional[int] = None,
+        memory_limit: Optional[str] = None,
+        gold_cache: Optional[GoldResultCache] = None,
+        comparator: Optional[ResultComparator] = None,
+        timing_harness: Optional[TimingHarness] = None,
+        metrics: Optional[MetricsCollector] = None,
+    ) -> None:
+        self.config = {}
+        if threads is not None:
+            self.config["threads"] = threads
+        if memory_limit is not None:
+            self.config["memory_limit"] = memory_limit
+
+        self.gold_cache = gold_cache
+        self.comparator = comparator or ResultComparator()
+        self.timing_harness = timing_harness or TimingHarness()
+        self.metrics = metrics
+
+        self._lock = threading.Lock()
+        self._databases: dict[str, tuple] = {}
+
+    @staticmethod
+    def _resolve_source(dsn_or_db_path: str) -> str:
+        return os.path.abspath(convert_sqlite_dsn_to_path(str(dsn_or_db_path)))
+
+    def _open(self, source: str) -> tuple:
+        """Opens the DuckDB database of a source and returns it with the catalog to use"""
+        path = Path(source)
+        if path.suffix == ".duckdb":
+            return duckdb.connect(source, read_only=True, config=self.config), None
+
+        conn = duckdb.connect(":memory:", config=self.config)
+        if path.suffix in _SQLITE_SUFFIXES:
+            conn.execute("INSTALL sqlite")
+            conn.execute("LOAD sqlite")
+            conn.execute(
+                f"ATTACH {_quote_literal(source)} AS source (TYPE SQLITE, READ_ONLY)"
+            )
+            return conn, "source"
+
+        files = sorted(path.iterdir()) if path.is_dir() else [path]
+        num_views = 0
+        for file in files:
+            reader = _FILE_READERS.get(file.suffix.lower())
+            if reader is None:
+                continue
+            conn.execute(
+                f"CREATE VIEW {_quote_identifier(file.stem)} AS "
+                f"SELECT * FROM {reader}({_quote_literal(str(file))})"
+            )
+            num_views += 1
+
+        if num_views == 0:
+            conn.close()
+            raise SQLExecutionError(f"No SQLite, DuckDB, CSV or Parquet data in {source}")
+        logger.info(f"Exposed {num_views} files of {source} as views")
+        return conn, None
+
+    def get_cursor(self, dsn_or_db_path: str) -> "duckdb.DuckDBPyConnection":
+        """Returns a new cursor on the database of a source"""
+        source = self._resolve_source(dsn_or_db_path)
+        with self._lock:
+            if source not in self._databases:
+                try:
+                    self._databases[source] = self._open(source)
+                except duckdb.Error as e:
+                    raise SQLExecutionError(str(e)) from e
+            conn, catalog = self._databases[source]
+
+        cursor = conn.cursor()
+        if catalog is not None:
+            cursor.execute(f"USE {catalog}")
+        return cursor
+
+    @contextmanager
+    def _cursor(
+        self, dsn_or_db_path: str, trace: Optional[QueryTrace] = None
+    ) -> Generator["duckdb.DuckDBPyConnection", None, None]:
+        start_time = time.perf_counter()
+        cursor = self.get_cursor(dsn_or_db_path)
+        if trace is not None:
+            trace.record("connect", time.perf_counter() - start_time)
+        try:
+            yield cursor
+        except duckdb.Error as e:
+            raise SQLExecutionError(str(e)) from e
+        finally:
+            cursor.close()
+
+    def execute_sql(self, sql: str, dsn_or_db_path: str) -> dict:
+        start_time = time.time()
+        with self.trace(dsn_or_db_path) as trace:
+            try:
+                with self._cursor(dsn_or_db_path, trace=trace) as cursor:
+                    with trace.phase("execute"):
+                        cursor.execute(sql)
+                    with trace.phase("fetch"):
+                        result = cursor.fetchall() if cursor.description else []
+                    trace.add_rows(result)
+                    error = None
+            except SQLExecutionError as e:
+                result = None
+                error = trace.error = str(e)
+
+        return {
+            "result": result,
+            "error": error,
+            "execution_time": time.time() - start_time,
+        }
+
+    @contextmanager
+    def stream_sql(
+        self, sql: str, dsn_or_db_path: str, chunk_size: Optional[int] = 1000
+    ) -> Generator[ResultStream, None, None]:
+        with self.trace(dsn_or_db_path) as trace, self._cursor(
+            dsn_or_db_path, trace=trace
+        ) as cursor:
+            with trace.phase("execute"):
+                cursor.execute(sql)
+
+            def chunks() -> Iterator[list]:
+                if not cursor.description:
+                    return
+                while True:
+                    try:
+                        with trace.phase("fetch"):
+                            rows = cursor.fetchmany(chunk_size)
+                    except duckdb.Error as e:
+                        raise SQLExecutionError(str(e)) from e
+                    if not rows:
+                        return
+                    trace.add_rows(rows)
+                    yield rows
+
+            columns = [column[0] for column in cursor.description or []]
+            yield ResultStream(chunks=chunks(), columns=columns)
+
+    @contextmanager
+    def timed_runner(self, dsn_or_db_path: str) -> Generator[QueryRunner, None, None]:
+        with self._cursor(dsn_or_db_path) as cursor:
+
+            def run(sql: str) -> int:
+                try:
+                    start_time = time.perf_counter_ns()
+                    cursor.execute(sql)
+                    if cursor.description:
+                        while cursor.fetchmany(1000):
+                            pass
+                    return time.perf_counter_ns() - start_time
+                except duckdb.Error as e:
+                    raise SQLExecutionError(str(e)) from e
+
+            yield QueryRunner(run=run)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn, _ in self._databases.values():
+                conn.close()
+            self._databases.clear()
+
+    def __getstate__(self) -> dict:
+        # Sources are opened again in the other process
+        state = super().__getstate__()
+        del state["_lock"], state["_databases"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._databases = {}
@@ -1,29 +1,132 @@
+import threading
 import time
-from typing import Union
+from typing import Optional, Union
 
 from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy.engine import make_url
 
 from premsql.executors.base import BaseExecutor
+from premsql.executors.metrics import MetricsCollector
+from premsql.logger import setup_console_logger
 from premsql.utils import convert_sqlite_path_to_dsn
 
+logger = setup_console_logger(name="[LANGCHAIN-EXEC]")
+
+
+class SQLDatabaseRegistry:
+    """Keeps one SQLAlchemy engine and SQLDatabase per DSN.
+
+    Creating a SQLDatabase builds a new engine and reflects the schema, so
+    the objects are created once and reused by every later call. Tables are
+    reflected lazily by default, as running a query does not need the
+    schema. Use `refresh` after a schema change and `dispose` to release
+    the pooled connections.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = 5,
+        max_overflow: Optional[int] = 10,
+        lazy_table_reflection: Optional[bool] = True,
+        **sql_database_kwargs,
+    ) -> None:
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.sql_database_kwargs = {
+            "lazy_table_reflection": lazy_table_reflection,
+            **sql_database_kwargs,
+        }
+        self._lock = threading.Lock()
+        self._databases: dict[str, SQLDatabase] = {}
+
+    def get(self, dsn: str) -> SQLDatabase:
+        with self._lock:
+            db = self._databases.get(dsn)
+            if db is None:
+                db = SQLDatabase.from_uri(
+                    dsn,
+                    engine_args=self._engine_args(dsn),
+                    **self.sql_database_kwargs,
+                )
+                self._databases[dsn] = db
+                logger.info(f"Created engine for: {make_url(dsn).render_as_string()}")
+            return db
+
+    def _engine_args(self, dsn: str) -> dict:
+        # In-memory sqlite databases use a single connection pool which does
+        # not accept a pool size
+        url = make_url(dsn)
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            return {}
+        return {"pool_size": self.pool_size, "max_overflow": self.max_overflow}
+
+    def refresh(self, dsn: str) -> SQLDatabase:
+        """Drops the cached schema of a DSN and reflects it again"""
+        self.dispose(dsn)
+        return self.get(dsn)
+
+    def dispose(self, dsn: Optional[str] = None) -> None:
+        with self._lock:
+            dsns = list(self._databases.keys()) if dsn is None else [dsn]
+            for key in dsns:
+                db = self._databases.pop(key, None)
+                if db is not None:
+                    db._engine.dispose()
+
+    def __contains__(self, dsn: str) -> bool:
+        return dsn in self._databases
+
+    def __getstate__(self) -> dict:
+        # Databases are reflected again in the other process
+        state = self.__dict__.copy()
+        del state["_lock"], state["_databases"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._databases = {}
+
 
 class ExecutorUsingLangChain(BaseExecutor):
+    def __init__(
+        self,
+        registry: Optional[SQLDatabaseRegistry] = None,
+        metrics: Optional[MetricsCollector] = None,
+    ) -> None:
+        self.registry = registry or SQLDatabaseRegistry()
+        self.metrics = metrics
 
     def execute_sql(self, sql: str, dsn_or_db_path: Union[str, SQLDatabase]) -> dict:
         if isinstance(dsn_or_db_path, str):
             if dsn_or_db_path.endswith("sqlite"):
                 dsn_or_db_path = convert_sqlite_path_to_dsn(path=dsn_or_db_path)
-            db = SQLDatabase.from_uri(dsn_or_db_path)
+            url = make_url(dsn_or_db_path)
         else:
-            db = dsn_or_db_path
+            url = dsn_or_db_path._engine.url
+
+        # Metrics are labelled with the URL of the database, without password
+        with self.trace(url.render_as_string(hide_password=True)) as trace:
+            with trace.phase("connect"):
+                if isinstance(dsn_or_db_path, str):
+                    db = self.registry.get(dsn_or_db_path)
+                else:
+                    db = dsn_or_db_path
 
-        start_time = time.time()
-        response = db.run_no_throw(sql)
-        end_time = time.time()
+            start_time = time.time()
+            with trace.phase("execute"):
+                response = db.run_no_throw(sql)
+            end_time = time.time()
 
-        error = response if response.startswith("Error") else None
+            # The result is already rendered as a string by langchain
+            error = trace.error = response if response.startswith("Error") else None
+            if trace.count_bytes:
+                trace.bytes = len(response)
         return {
             "result": None if error else response,
             "error": error,
             "execution_time": end_time - start_time,
         }
+
+    def close(self) -> None:
+        self.registry.dispose()
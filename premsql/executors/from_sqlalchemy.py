@@ -0,0 +1,265 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Generator, Iterator, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+
+from premsql.executors.base import (
+    BaseExecutor,
+    QueryRunner,
+    ResultStream,
+    SQLExecutionError,
+)
+from premsql.executors.cache import GoldResultCache
+from premsql.executors.compare import ResultComparator
+from premsql.executors.metrics import MetricsCollector, QueryTrace
+from premsql.executors.timing import TimingHarness
+from premsql.logger import setup_console_logger
+from premsql.utils import convert_sqlite_path_to_dsn
+
+logger = setup_console_logger(name="[SQLALCHEMY-EXEC]")
+
+
+def _error_message(error: SQLAlchemyError) -> str:
+    # Drop the SQL and the background link appended by SQLAlchemy
+    return str(getattr(error, "orig", None) or error)
+
+
+class SQLAlchemyExecutor(BaseExecutor):
+    """Executes SQL on any database supported by SQLAlchemy.
+
+    One engine with a `QueuePool` is kept per DSN. Results are fetched with
+    server side cursors (`stream_results`) in chunks of `chunk_size` rows
+    and returned as tuples, so they can be compared with `match_sqls`.
+
+    `statement_timeout` (in seconds) is enforced by the database for
+    PostgreSQL (`SET LOCAL statement_timeout`) and MySQL
+    (`max_execution_time`, SELECT only) and with a progress handler for
+    SQLite. Other dialects run without a timeout.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = 5,
+        max_overflow: Optional[int] = 10,
+        pool_recycle: Optional[int] = 3600,
+        statement_timeout: Optional[float] = None,
+        chunk_size: Optional[int] = 1000,
+        gold_cache: Optional[GoldResultCache] = None,
+        comparator: Optional[ResultComparator] = None,
+        timing_harness: Optional[TimingHarness] = None,
+        metrics: Optional[MetricsCollector] = None,
+        **engine_kwargs,
+    ) -> None:
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.statement_timeout = statement_timeout
+        self.chunk_size = chunk_size
+        self.gold_cache = gold_cache
+        self.comparator = comparator or ResultComparator()
+        self.timing_harness = timing_harness or TimingHarness()
+        self.metrics = metrics
+        self.engine_kwargs = engine_kwargs
+        self.max_concurrency_per_db = pool_size + max_overflow
+
+        self._lock = threading.Lock()
+        self._engines: dict[str, Engine] = {}
+
+    @staticmethod
+    def _to_dsn(dsn_or_db_path: str) -> str:
+        if "://" not in dsn_or_db_path:
+            return convert_sqlite_path_to_dsn(path=dsn_or_db_path)
+        return dsn_or_db_path
+
+    def get_engine(self, dsn_or_db_path: str) -> Engine:
+        dsn = self._to_dsn(dsn_or_db_path)
+        with self._lock:
+            engine = self._engines.get(dsn)
+            if engine is None:
+                engine = create_engine(dsn, **self._engine_args(dsn))
+                if engine.dialect.name == "sqlite":
+                    event.listen(engine, "before_cursor_execute", self._reset_deadline)
+                self._engines[dsn] = engine
+                logger.info(f"Created engine for: {make_url(dsn).render_as_string()}")
+            return engine
+
+    def _engine_args(self, dsn: str) -> dict:
+        url = make_url(dsn)
+        engine_args = {"pool_pre_ping": True, **self.engine_kwargs}
+        # Every connection to an in-memory sqlite database opens a new
+        # database, so those keep the default single connection pool.
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            return engine_args
+        return {
+            "poolclass": QueuePool,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_recycle": self.pool_recycle,
+            **engine_args,
+        }
+
+    @contextmanager
+    def connect(
+        self, dsn_or_db_path: str, trace: Optional[QueryTrace] = None
+    ) -> Generator[Connection, None, None]:
+        """Yields a pooled connection with the statement timeout applied"""
+        start_time = time.perf_counter()
+        try:
+            conn = self.get_engine(dsn_or_db_path).connect()
+        except SQLAlchemyError as e:
+            raise SQLExecutionError(_error_message(e)) from e
+        if trace is not None:
+            trace.record("connect", time.perf_counter() - start_time)
+
+        try:
+            with conn:
+                with self._statement_timeout(conn):
+                    yield conn
+        except SQLAlchemyError as e:
+            raise SQLExecutionError(_error_message(e)) from e
+
+    def _reset_deadline(self, conn: Connection, *args) -> None:
+        # The sqlite timeout is restarted for every statement
+        if self.statement_timeout is not None:
+            conn.info["deadline"] = time.perf_counter() + self.statement_timeout
+
+    @contextmanager
+    def _statement_timeout(self, conn: Connection) -> Generator[None, None, None]:
+        if self.statement_timeout is None:
+            yield
+            return
+
+        dialect = conn.dialect.name
+        timeout_ms = int(self.statement_timeout * 1000)
+        if dialect == "postgresql":
+            # SET LOCAL only lasts until the end of the current transaction
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+            yield
+        elif dialect in ("mysql", "mariadb"):
+            if conn.dialect.is_mariadb:
+                conn.exec_driver_sql(
+                    f"SET SESSION max_statement_time = {self.statement_timeout}"
+                )
+            else:
+                conn.exec_driver_sql(f"SET SESSION max_execution_time = {timeout_ms}")
+            yield
+        elif dialect == "sqlite":
+            dbapi_conn, state = conn.connection.dbapi_connection, conn.info
+            self._reset_deadline(conn)
+            dbapi_conn.set_progress_handler(
+                lambda: int(time.perf_counter() > state["deadline"]), 1000
+            )
+            try:
+                yield
+            except SQLAlchemyError as e:
+                if time.perf_counter() > state["deadline"]:
+                    raise SQLExecutionError(
+                        f"Statement timeout of {self.statement_timeout}s exceeded"
+                    ) from e
+                raise
+            finally:
+                dbapi_conn.set_progress_handler(None, 1000)
+        else:
+            logger.warning(f"Statement timeouts are not supported for {dialect}")
+            yield
+
+    def execute_sql(self, sql: str, dsn_or_db_path: str) -> dict:
+        start_time = time.time()
+        with self.trace(dsn_or_db_path) as trace:
+            try:
+                with self.connect(dsn_or_db_path, trace=trace) as conn:
+                    with trace.phase("execute"):
+                        result = conn.execution_options(
+                            stream_results=True
+                        ).exec_driver_sql(sql)
+                    rows = []
+                    with trace.phase("fetch"):
+                        if result.returns_rows:
+                            for partition in result.partitions(self.chunk_size):
+                                rows.extend(tuple(row) for row in partition)
+                    trace.add_rows(rows)
+                    error = None
+            except SQLExecutionError as e:
+                rows = None
+                error = trace.error = str(e)
+
+        return {
+            "result": rows,
+            "error": error,
+            "execution_time": time.time() - start_time,
+        }
+
+    @contextmanager
+    def stream_sql(
+        self, sql: str, dsn_or_db_path: str, chunk_size: Optional[int] = 1000
+    ) -> Generator[ResultStream, None, None]:
+        with self.trace(dsn_or_db_path) as trace, self.connect(
+            dsn_or_db_path, trace=trace
+        ) as conn:
+            with trace.phase("execute"):
+                result = conn.execution_options(
+                    stream_results=True, yield_per=chunk_size
+                ).exec_driver_sql(sql)
+
+            def chunks() -> Iterator[list]:
+                if not result.returns_rows:
+                    return
+                partitions = result.partitions(chunk_size)
+                while True:
+                    try:
+                        with trace.phase("fetch"):
+                            partition = next(partitions, None)
+                    except SQLAlchemyError as e:
+                        raise SQLExecutionError(_error_message(e)) from e
+                    if partition is None:
+                        return
+                    rows = [tuple(row) for row in partition]
+                    trace.add_rows(rows)
+                    yield rows
+
+            columns = list(result.keys()) if result.returns_rows else []
+            try:
+                yield ResultStream(chunks=chunks(), columns=columns)
+            finally:
+                result.close()
+
+    @contextmanager
+    def timed_runner(self, dsn_or_db_path: str) -> Generator[QueryRunner, None, None]:
+        with self.connect(dsn_or_db_path) as conn:
+
+            def run(sql: str) -> int:
+                try:
+                    start_time = time.perf_counter_ns()
+                    result = conn.execution_options(stream_results=True).exec_driver_sql(
+                        sql
+                    )
+                    if result.returns_rows:
+                        for _ in result.partitions(self.chunk_size):
+                            pass
+                    return time.perf_counter_ns() - start_time
+                except SQLAlchemyError as e:
+                    raise SQLExecutionError(_error_message(e)) from e
+
+            yield QueryRunner(run=run)
+
+    def close(self) -> None:
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+    def __getstate__(self) -> dict:
+        # Engines and their pools are created again in the other process
+        state = super().__getstate__()
+        del state["_lock"], state["_engines"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._engines = {}
@@ -1,117 +1,516 @@
+import asyncio
+import functools
 import sqlite3
+import threading
 import time
 
-from contextlib import contextmanager
-from typing import Any, Dict, Generator 
-from premsql.executors.base import BaseExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, Generator, Iterator, Literal, Optional
+
+from premsql.executors.base import (
+    BaseExecutor,
+    QueryRunner,
+    ResultStream,
+    SQLExecutionError,
+)
+from premsql.executors.cache import GoldResultCache
+from premsql.executors.compare import ResultComparator
+from premsql.executors.metrics import MetricsCollector, QueryTrace
+from premsql.executors.plan import QueryPlanInspector
+from premsql.executors.pool import SQLiteConnectionPool, resolve_sqlite_path
+from premsql.executors.screen import QueryCostScreen
+from premsql.executors.snapshot import SQLiteSnapshotStore
+from premsql.executors.timing import TimingHarness
 from premsql.logger import setup_console_logger
 
 
-class OptimizedSQLiteExecutor(BaseExecutor):
-    def __init__(self, timeout: float = 1000.0) -> None:
+class _InterruptHandle:
+    """Tracks the connections used by one async call so it can be cancelled"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.connections: set[sqlite3.Connection] = set()
+        self.cancelled = False
+
+    def register(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise SQLExecutionError("Query cancelled")
+            self.connections.add(conn)
+
+    def unregister(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self.connections.discard(conn)
+
+    def interrupt(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            for conn in self.connections:
+                conn.interrupt()
+
+
+class SQLiteExecutorBase(BaseExecutor):
+    """Shares the pooled connections and result streaming of the SQLite executors
+
+    Queries running under `deadline` are stopped by sqlite itself through a
+    progress handler, so a timed out query does not keep running in the
+    background.
+
+    `open_mode` selects how databases are opened:
+        - "default": the database file is opened read-write.
+        - "readonly": the file is opened as an immutable read-only URI with
+          `query_only` and memory mapped I/O (`mmap_size_mb`). No locks are
+          taken and no -wal/-shm files are written, so several processes can
+          share benchmark databases. The files must not change meanwhile.
+        - "memory": every database is copied once into a shared in-memory
+          snapshot (within `memory_budget_mb`) and all the queries on it are
+          served from memory. Only meant for read-only workloads.
+    """
+
+    supports_interrupt = True
+    progress_steps = 1000
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = 4,
+        idle_timeout: Optional[float] = 300.0,
+        gold_cache: Optional[GoldResultCache] = None,
+        comparator: Optional[ResultComparator] = None,
+        timing_harness: Optional[TimingHarness] = None,
+        plan_inspector: Optional[QueryPlanInspector] = None,
+        cost_screen: Optional[QueryCostScreen] = None,
+        open_mode: Optional[Literal["default", "readonly", "memory"]] = "default",
+        memory_budget_mb: Optional[float] = 2048,
+        mmap_size_mb: Optional[float] = 256,
+        metrics: Optional[MetricsCollector] = None,
+    ) -> None:
+        assert open_mode in ["default", "readonly", "memory"], "Invalid open_mode"
+        self.gold_cache = gold_cache
+        self.comparator = comparator or ResultComparator()
+        self.timing_harness = timing_harness or TimingHarness()
+        self.plan_inspector = plan_inspector
+        self.cost_screen = cost_screen
+        self.metrics = metrics
+        self.open_mode = open_mode
+        self.mmap_size_mb = mmap_size_mb
+        self.pool = SQLiteConnectionPool(
+            max_size=pool_size,
+            idle_timeout=idle_timeout,
+            connect_fn=self._connect,
+            validate_fn=self._is_current if open_mode == "memory" else None,
+        )
+        self.snapshot_store = (
+            SQLiteSnapshotStore(
+                memory_budget_mb=memory_budget_mb, on_evict=self.pool.close
+            )
+            if open_mode == "memory"
+            else None
+        )
+        self.max_concurrency_per_db = pool_size
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.reset_interrupt_stats()
+
+    def _open(self, db_path: str, **connect_kwargs) -> sqlite3.Connection:
+        if self.snapshot_store is not None:
+            conn = self.snapshot_store.connect(db_path, **connect_kwargs)
+            if conn is not None:
+                return conn
+
+        if self.open_mode == "readonly":
+            uri = f"{Path(db_path).as_uri()}?mode=ro&immutable=1"
+            conn = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, **connect_kwargs
+            )
+            conn.execute("PRAGMA query_only = 1")
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size_mb * 1024 * 1024)}")
+            return conn
+        return sqlite3.connect(db_path, check_same_thread=False, **connect_kwargs)
+
+    def _connect(self, db_path: str) -> sqlite3.Connection:
+        return self._open(db_path)
+
+    def _is_current(self, db_path: str, conn: sqlite3.Connection) -> bool:
+        # Closing the connections of an evicted snapshot frees its memory
+        return self.snapshot_store.is_current(db_path, conn)
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        del state["_local"], state["_stats_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+    @contextmanager
+    def deadline(self, seconds: float) -> Generator[dict, None, None]:
+        """Interrupts every query of the current thread running past `seconds`"""
+        state = {"deadline": time.perf_counter() + seconds, "interrupted": False}
+        previous = getattr(self._local, "deadline", None)
+        if previous is not None:
+            state["deadline"] = min(state["deadline"], previous["deadline"])
+
+        self._local.deadline = state
+        try:
+            yield state
+        finally:
+            self._local.deadline = previous
+            if previous is not None and state["interrupted"]:
+                previous["interrupted"] = True
+
+    def reset_interrupt_stats(self) -> None:
+        with self._stats_lock:
+            self.interrupt_stats = {
+                "interrupted_queries": 0,
+                "interrupted_query_time": 0.0,
+                "max_interrupt_latency": 0.0,
+            }
+
+    def _record_interrupt(self, query_time: float, latency: float) -> None:
+        with self._stats_lock:
+            self.interrupt_stats["interrupted_queries"] += 1
+            self.interrupt_stats["interrupted_query_time"] += query_time
+            self.interrupt_stats["max_interrupt_latency"] = max(
+                self.interrupt_stats["max_interrupt_latency"], latency
+            )
+
+    def inspect_plan(
+        self,
+        conn: sqlite3.Connection,
+        sql: str,
+        dsn_or_db_path: str,
+        trace: Optional[QueryTrace] = None,
+    ) -> Optional[dict]:
+        if self.plan_inspector is None:
+            return None
+        with trace.phase("plan") if trace is not None else nullcontext():
+            return self.plan_inspector.inspect(
+                conn=conn, db_path=resolve_sqlite_path(dsn_or_db_path), sql=sql
+            )
+
+    def screen_sql(
+        self,
+        conn: sqlite3.Connection,
+        sql: str,
+        dsn_or_db_path: str,
+        action: Optional[Literal["reject", "limit"]] = None,
+    ) -> dict:
+        """Runs the cost screen, returns the SQL to execute or the rejection"""
+        if self.cost_screen is None:
+            return {"sql": sql, "error": None}
+        return self.cost_screen.screen(
+            conn=conn,
+            db_path=resolve_sqlite_path(dsn_or_db_path),
+            sql=sql,
+            action=action,
+        )
+
+    def screen_predicted(self, sql: str, dsn_or_db_path: str) -> Optional[str]:
+        if self.cost_screen is None:
+            return None
+        with self.get_connection(dsn_or_db_path) as conn:
+            return self.screen_sql(conn, sql, dsn_or_db_path, action="reject")["error"]
+
+    async def _run_async(
+        self, dsn_or_db_path: str, func: Callable[..., Any], /, **kwargs
+    ) -> Any:
+        # Cancelling the awaiting task interrupts the sqlite statement which
+        # is running in the worker thread.
+        loop = asyncio.get_running_loop()
+        handle = _InterruptHandle()
+        async with self._async_semaphore(dsn_or_db_path):
+            future = loop.run_in_executor(
+                None, functools.partial(self._run_interruptible, handle, func, **kwargs)
+            )
+            try:
+                return await future
+            except asyncio.CancelledError:
+                handle.interrupt()
+                raise
+
+    def _run_interruptible(
+        self, handle: _InterruptHandle, func: Callable[..., Any], **kwargs
+    ) -> Any:
+        self._local.interrupt_handle = handle
+        try:
+            return func(**kwargs)
+        finally:
+            self._local.interrupt_handle = None
+
+    def _sessions(self) -> dict[str, sqlite3.Connection]:
+        if not hasattr(self._local, "sessions"):
+            self._local.sessions = {}
+        return self._local.sessions
+
+    @contextmanager
+    def session(self, dsn_or_db_path: str) -> Generator[None, None, None]:
+        """Pins one pooled connection to the current thread for the block.
+
+        Like a pooled connection, the pinned one is rolled back after every
+        query, so the changes of a write are never seen by the next queries.
+        """
+        db_path = resolve_sqlite_path(dsn_or_db_path)
+        sessions = self._sessions()
+        if db_path in sessions:
+            yield
+            return
+
+        with self.pool.connection(db_path) as conn:
+            sessions[db_path] = conn
+            try:
+                yield
+            finally:
+                del sessions[db_path]
+
+    @contextmanager
+    def get_connection(
+        self, db_path: str, trace: Optional[QueryTrace] = None
+    ) -> Generator[sqlite3.Connection, None, None]:
+        db_path = resolve_sqlite_path(db_path)
+        if self.snapshot_store is not None:
+            self.snapshot_store.touch(db_path)
+
+        start_time = time.perf_counter()
+        pinned = self._sessions().get(db_path)
+        connection = (
+            nullcontext(pinned) if pinned is not None else self.pool.connection(db_path)
+        )
+        with connection as conn:
+            if trace is not None:
+                trace.record("connect", time.perf_counter() - start_time)
+            handle = getattr(self._local, "interrupt_handle", None)
+            if handle is not None:
+                handle.register(conn)
+            try:
+                with self._with_deadline(conn):
+                    yield conn
+            finally:
+                if handle is not None:
+                    handle.unregister(conn)
+                if pinned is not None:
+                    # The pool rolls back a connection when it is released, a
+                    # pinned one has to be rolled back after every query
+                    self._rollback(conn)
+
+    @staticmethod
+    def _rollback(conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def _with_deadline(self, conn: sqlite3.Connection) -> Generator[None, None, None]:
+        # A connection pinned by a session can be used by nested streams, the
+        # outermost one owns the progress handler.
+        state = getattr(self._local, "deadline", None)
+        guarded = self._local.__dict__.setdefault("guarded_connections", set())
+        if state is None or id(conn) in guarded:
+            yield
+            return
+
+        start_time, tripped = time.perf_counter(), False
+
+        def progress_handler() -> int:
+            nonlocal tripped
+            now = time.perf_counter()
+            if now < state["deadline"]:
+                return 0
+            if not tripped:
+                tripped, state["interrupted"] = True, True
+                self._record_interrupt(now - start_time, now - state["deadline"])
+            return 1
+
+        conn.set_progress_handler(progress_handler, self.progress_steps)
+        guarded.add(id(conn))
+        try:
+            yield
+        finally:
+            guarded.discard(id(conn))
+            conn.set_progress_handler(None, self.progress_steps)
+
+    @contextmanager
+    def stream_sql(
+        self, sql: str, dsn_or_db_path: str, chunk_size: Optional[int] = 1000
+    ) -> Generator[ResultStream, None, None]:
+        with self.trace(dsn_or_db_path) as trace, self.get_connection(
+            dsn_or_db_path, trace=trace
+        ) as conn:
+            cursor = conn.cursor()
+            try:
+                with trace.phase("execute"):
+                    cursor.execute(sql)
+            except sqlite3.Error as e:
+                cursor.close()
+                raise SQLExecutionError(str(e)) from e
+            if cursor.description is None:
+                # A statement without rows (e.g. a DELETE) is undone right
+                # away, before other queries share this connection
+                self._rollback(conn)
+
+            def chunks() -> Iterator[list]:
+                while True:
+                    try:
+                        with trace.phase("fetch"):
+                            rows = cursor.fetchmany(chunk_size)
+                    except sqlite3.Error as e:
+                        raise SQLExecutionError(str(e)) from e
+                    if not rows:
+                        return
+                    trace.add_rows(rows)
+                    yield rows
+
+            columns = [column[0] for column in cursor.description or []]
+            try:
+                yield ResultStream(chunks=chunks(), columns=columns)
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def timed_runner(self, dsn_or_db_path: str) -> Generator[QueryRunner, None, None]:
+        # A single connection is held for all the runs, so that only the
+        # execution and the fetching of the rows are timed.
+        with self.get_connection(dsn_or_db_path) as conn:
+
+            def run(sql: str) -> int:
+                cursor = conn.cursor()
+                try:
+                    start_time = time.perf_counter_ns()
+                    cursor.execute(sql)
+                    while cursor.fetchmany(1000):
+                        pass
+                    return time.perf_counter_ns() - start_time
+                except sqlite3.Error as e:
+                    raise SQLExecutionError(str(e)) from e
+                finally:
+                    cursor.close()
+
+            def reset_cache() -> None:
+                conn.execute("PRAGMA shrink_memory")
+
+            yield QueryRunner(run=run, reset_cache=reset_cache)
+
+    def close(self) -> None:
+        self.pool.close_all()
+        if self.snapshot_store is not None:
+            self.snapshot_store.close_all()
+
+
+class OptimizedSQLiteExecutor(SQLiteExecutorBase):
+    def __init__(
+        self,
+        timeout: float = 1000.0,
+        pool_size: Optional[int] = 4,
+        idle_timeout: Optional[float] = 300.0,
+        gold_cache: Optional[GoldResultCache] = None,
+        comparator: Optional[ResultComparator] = None,
+        timing_harness: Optional[TimingHarness] = None,
+        plan_inspector: Optional[QueryPlanInspector] = None,
+        cost_screen: Optional[QueryCostScreen] = None,
+        open_mode: Optional[Literal["default", "readonly", "memory"]] = "default",
+        memory_budget_mb: Optional[float] = 2048,
+        mmap_size_mb: Optional[float] = 256,
+        metrics: Optional[MetricsCollector] = None,
+    ) -> None:
         self.timeout = timeout
         self.logger = setup_console_logger(name="[OPTIMIZED-SQLite-EXEC]")
+        super().__init__(
+            pool_size=pool_size,
+            idle_timeout=idle_timeout,
+            gold_cache=gold_cache,
+            comparator=comparator,
+            timing_harness=timing_harness,
+            plan_inspector=plan_inspector,
+            cost_screen=cost_screen,
+            open_mode=open_mode,
+            memory_budget_mb=memory_budget_mb,
+            mmap_size_mb=mmap_size_mb,
+            metrics=metrics,
+        )
 
-    @contextmanager
-    def get_connection(self, db_path: str) -> Generator[sqlite3.Connection, None, None]:
-        if db_path.startswith("sqlite:///"):
-            db_path = db_path.split("sqlite:///")[1]
-        
-        conn = sqlite3.connect(db_path, timeout=self.timeout)
-        conn.execute("PRAGMA journal_mode = WAL")
+    def _connect(self, db_path: str) -> sqlite3.Connection:
+        conn = self._open(db_path, timeout=self.timeout)
+        if self.open_mode == "default":
+            conn.execute("PRAGMA journal_mode = WAL")
         conn.execute("PRAGMA synchronous = NORMAL")
         conn.execute("PRAGMA cache_size = -64000")  # 64MB cache
         conn.execute("PRAGMA temp_store = MEMORY")
         conn.row_factory = sqlite3.Row
-        try:
-            yield conn 
-        finally:
-            conn.close() 
-        
+        return conn
+
     def execute_sql(self, sql: str, dsn_or_db_path: str) -> Dict[str, Any]:
-        start_time = time.time()
-        try:
-            with self.get_connection(dsn_or_db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("EXPLAIN QUERY PLAN " + sql)
-                query_plan = cursor.fetchall()
-                
-                if any("SCAN TABLE" in str(row) for row in query_plan):
-                    self.logger.warn("Warning: Full table scan detected. Consider adding an index.")
-                
-                cursor.execute(sql)
-                result = [dict(row) for row in cursor.fetchall()]
-                error = None
-        except sqlite3.Error as e:
-            result = None
-            error = str(e)
-        finally:
-            end_time = time.time()
+        start_time, query_plan, screened = time.time(), None, None
+        with self.trace(dsn_or_db_path) as trace:
+            try:
+                with self.get_connection(dsn_or_db_path, trace=trace) as conn:
+                    query_plan = self.inspect_plan(conn, sql, dsn_or_db_path, trace)
+                    screened = self.screen_sql(conn, sql, dsn_or_db_path)
+                    if screened["error"] is not None:
+                        raise sqlite3.DatabaseError(screened["error"])
 
-        return {
+                    cursor = conn.cursor()
+                    with trace.phase("execute"):
+                        cursor.execute(screened["sql"])
+                    with trace.phase("fetch"):
+                        result = [dict(row) for row in cursor.fetchall()]
+                    trace.add_rows(result)
+                    error = None
+            except sqlite3.Error as e:
+                result = None
+                error = trace.error = str(e)
+            finally:
+                end_time = time.time()
+
+        result = {
             "result": result,
             "error": error,
             "execution_time": end_time - start_time,
         }
-    
-    def match_sqls(self, predicted_sql: str, gold_sql: str, dsn_or_db_path: str) -> Dict[str, Any]:
-        with self.get_connection(dsn_or_db_path) as conn:
-            prediction = self.execute_sql(predicted_sql, dsn_or_db_path)
-            gold = self.execute_sql(gold_sql, dsn_or_db_path)
-
-        if prediction["error"]:
-            return {"result": 0, "error": prediction["error"]}
-
-        is_match = set(map(tuple, prediction["result"])) == set(map(tuple, gold["result"]))
-        return {
-            "result": int(is_match),
-            "error": None if is_match else "Table mismatch",
-        }
-
-    def iterated_execution(self, predicted_sql: str, gold_sql: str, dsn_or_db_path: str, num_iterations: int) -> Dict[str, Any]:
-        is_match = self.match_sqls(predicted_sql, gold_sql, dsn_or_db_path)
-
-        if is_match["result"] == 1:
-            with self.get_connection(dsn_or_db_path) as conn:
-                diff_list = []
-                for _ in range(num_iterations):
-                    gold_time = self.execute_sql(gold_sql, dsn_or_db_path)["execution_time"]
-                    predicted_time = self.execute_sql(predicted_sql, dsn_or_db_path)["execution_time"]
-                    diff_list.append(predicted_time / gold_time if gold_time > 0 else float('inf'))
-
-            processed_diff_list = self.clean_abnormal(diff_list)
-            return {
-                "result": sum(processed_diff_list) / len(processed_diff_list) if processed_diff_list else 0,
-                "error": None,
-            }
-        return {"result": 0, "error": is_match["error"]}
-
+        if self.plan_inspector is not None:
+            result["query_plan"] = query_plan
+        if self.cost_screen is not None:
+            result["screen"] = screened
+        return result
 
 
-class SQLiteExecutor(BaseExecutor):
+class SQLiteExecutor(SQLiteExecutorBase):
     def execute_sql(self, sql: str, dsn_or_db_path: str) -> dict:
-        if dsn_or_db_path.startswith("sqlite:///"):
-            dsn_or_db_path = dsn_or_db_path.split("sqlite:///")[1]
-            
-        conn = sqlite3.connect(dsn_or_db_path)
-        cursor = conn.cursor()
+        with self.trace(dsn_or_db_path) as trace, self.get_connection(
+            dsn_or_db_path, trace=trace
+        ) as conn:
+            query_plan = self.inspect_plan(conn, sql, dsn_or_db_path, trace)
+            screened = self.screen_sql(conn, sql, dsn_or_db_path)
+            cursor = conn.cursor()
 
-        start_time = time.time()
-        try:
-            cursor.execute(sql)
-            result = cursor.fetchall()
-            error = None
-        except Exception as e:
-            result = None
-            error = str(e)
+            start_time = time.time()
+            try:
+                if screened["error"] is not None:
+                    raise sqlite3.DatabaseError(screened["error"])
+                with trace.phase("execute"):
+                    cursor.execute(screened["sql"])
+                with trace.phase("fetch"):
+                    result = cursor.fetchall()
+                trace.add_rows(result)
+                error = None
+            except Exception as e:
+                # MemoryError has no message
+                result = None
+                error = trace.error = str(e) or type(e).__name__
 
-        end_time = time.time()
-        cursor.close()
-        conn.close()
+            end_time = time.time()
+            cursor.close()
 
         result = {
             "result": result,
             "error": error,
             "execution_time": end_time - start_time,
         }
-        return result
\ No newline at end of file
+        if self.plan_inspector is not None:
+            result["query_plan"] = query_plan
+        if self.cost_screen is not None:
+            result["screen"] = screened
+        return result
@@ -0,0 +1,502 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional, Union
+
+from premsql.executors.base import group_by_database
+from premsql.executors.plan import parse_query_plan, table_aliases
+from premsql.executors.pool import resolve_sqlite_path
+from premsql.executors.timing import TimingHarness
+from premsql.logger import setup_console_logger
+from premsql.sql import SQLITE_KEYWORDS, tokenize
+
+logger = setup_console_logger(name="[INDEX-ADVISOR]")
+
+_EQUALITY_OPERATORS = frozenset(["=", "==", "IN", "IS"])
+_RANGE_OPERATORS = frozenset(["<", ">", "<=", ">=", "BETWEEN"])
+_AUTOMATIC_INDEX_PATTERN = re.compile(
+    r"USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((?P<columns>[^)]*)\)"
+)
+_LOOP_TABLE_PATTERN = re.compile(r"^(?:SEARCH|SCAN)\s+(?:TABLE\s+)?(?P<table>\S+)")
+_UNSAFE_NAME_CHARACTERS = re.compile(r"[^A-Za-z0-9_]")
+# Authorizer actions of a statement which only reads the database
+_READ_ACTIONS = frozenset(
+    [sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION]
+    + [getattr(sqlite3, "SQLITE_RECURSIVE", 33)]
+)
+
+
+def _quote_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _unquote(kind: str, text: str) -> str:
+    if kind == "quoted":
+        text = text[1:-1]
+    return text.lower()
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class IndexAdvisor:
+    """Recommends sqlite indexes for a workload by measuring them.
+
+    Candidate indexes are derived from the query plans of the workload:
+    for every table read with a full scan, the columns it is filtered or
+    joined on (equality columns first, then one range column) give single
+    and multi-column candidates, and the automatic indexes sqlite builds at
+    run time are proposed as permanent ones. The database is copied twice
+    into one scratch directory; each candidate is built on one copy and the
+    queries whose plan uses it are replayed on both copies with the timing
+    harness, so that both sides share the same file placement. The measured
+    speedup is reported along with the on-disk size of the index. Queries
+    which are not read-only are skipped.
+    """
+
+    def __init__(
+        self,
+        num_iterations: Optional[int] = 5,
+        max_candidates: Optional[int] = 20,
+        max_columns: Optional[int] = 3,
+        query_timeout: Optional[float] = 30.0,
+        scratch_dir: Optional[Union[str, Path]] = None,
+        timing_harness: Optional[TimingHarness] = None,
+    ) -> None:
+        self.num_iterations = num_iterations
+        self.max_candidates = max_candidates
+        self.max_columns = max_columns
+        self.query_timeout = query_timeout
+        self.scratch_dir = scratch_dir
+        self.timing_harness = timing_harness or TimingHarness(num_warmup=1)
+        self._deadline: Optional[float] = None
+
+    @staticmethod
+    def workload_from_json(
+        path: Union[str, Path],
+        sql_key: Optional[str] = "generated",
+        include_gold: Optional[bool] = False,
+    ) -> list[tuple[str, str]]:
+        """Reads (sql, db_path) pairs from a predict.json style file"""
+        with open(path, "r") as json_file:
+            responses = json.load(json_file)
+
+        workload = []
+        for response in responses:
+            workload.append((response[sql_key], response["db_path"]))
+            if include_gold and "SQL" in response:
+                workload.append((response["SQL"], response["db_path"]))
+        return workload
+
+    @staticmethod
+    def workload_from_history(memory) -> list[tuple[str, str]]:
+        """Reads (sql, db_path) pairs from an `AgentInteractionMemory` session"""
+        workload = []
+        for message in memory.get(order="ASC"):
+            output = message["message"]
+            if output is None or not output.sql_string:
+                continue
+            if output.error_from_sql_worker:
+                continue
+            workload.append((output.sql_string, output.db_connection_uri))
+        return workload
+
+    def _connect(self, db_path: str, read_only: Optional[bool] = False):
+        if read_only:
+            uri = f"{Path(db_path).as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+        if self.query_timeout is not None:
+            conn.set_progress_handler(self._check_deadline, 10000)
+        return conn
+
+    def _check_deadline(self) -> int:
+        return int(self._deadline is not None and time.perf_counter() > self._deadline)
+
+    def _run(self, conn: sqlite3.Connection, sql: str) -> int:
+        if self.query_timeout is not None:
+            self._deadline = time.perf_counter() + self.query_timeout
+        try:
+            start_time = time.perf_counter_ns()
+            cursor = conn.execute(sql)
+            while cursor.fetchmany(1000):
+                pass
+            return time.perf_counter_ns() - start_time
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                raise QueryTimeout(f"Query timeout of {self.query_timeout}s exceeded")
+            raise
+        finally:
+            self._deadline = None
+
+    @staticmethod
+    def is_read_only(conn: sqlite3.Connection, sql: str) -> bool:
+        """Whether a query only reads, checked by sqlite while preparing it"""
+        actions = set()
+
+        def authorizer(action, *args) -> int:
+            actions.add(action)
+            return sqlite3.SQLITE_OK
+
+        conn.set_authorizer(authorizer)
+        try:
+            conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+        finally:
+            conn.set_authorizer(None)
+        return actions <= _READ_ACTIONS
+
+    def _schema(self, conn: sqlite3.Connection) -> dict:
+        """Returns the columns and the leading index columns of every table"""
+        schema = {}
+        tables = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        for (table,) in tables:
+            quoted = _quote_identifier(table)
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quoted})")]
+            indexed = set()
+            for index_row in conn.execute(f"PRAGMA index_list({quoted})"):
+                info = conn.execute(
+                    f"PRAGMA index_info({_quote_identifier(index_row[1])})"
+                ).fetchall()
+                indexed.add(tuple(row[2].lower() for row in info if row[2]))
+            schema[table.lower()] = {
+                "name": table,
+                "columns": {column.lower(): column for column in columns},
+                "indexes": indexed,
+            }
+        return schema
+
+    def predicate_columns(self, sql: str, schema: dict) -> tuple[dict, dict]:
+        """Returns the aliases and the filtered or joined columns of a query.
+
+        The aliases map every alias (and table name) to its table, the
+        columns are {table: {"equality": Counter, "join": Counter,
+        "range": Counter}}. Columns are found next to a comparison operator,
+        either qualified with a table or alias, or unqualified when only one
+        of the tables of the query has a column of that name. An equality
+        with another column is a join, with anything else a filter.
+        """
+        tokens = [
+            (
+                kind,
+                (
+                    text.upper()
+                    if kind == "word" and text.upper() in SQLITE_KEYWORDS
+                    else text
+                ),
+            )
+            for kind, text in tokenize(sql)
+        ]
+        names = [
+            _unquote(kind, text) if kind in ("word", "quoted") else None
+            for kind, text in tokens
+        ]
+
+        aliases = table_aliases(sql, schema)
+
+        query_tables = set(aliases.values())
+        columns = defaultdict(
+            lambda: {"equality": Counter(), "join": Counter(), "range": Counter()}
+        )
+
+        for index, (kind, text) in enumerate(tokens):
+            if kind not in ("word", "quoted") or text in SQLITE_KEYWORDS:
+                continue
+            if index + 1 < len(tokens) and tokens[index + 1][1] in (".", "("):
+                continue
+            column = names[index]
+            qualified = index >= 2 and tokens[index - 1][1] == "."
+            if qualified:
+                table = aliases.get(names[index - 2])
+                if table is None or column not in schema[table]["columns"]:
+                    continue
+                start = index - 2
+            else:
+                owners = [t for t in query_tables if column in schema[t]["columns"]]
+                if len(owners) != 1:
+                    continue
+                table, start = owners[0], index
+
+            before = tokens[start - 1][1] if start > 0 else None
+            after_index = index + 1
+            if after_index < len(tokens) and tokens[after_index][1] == "NOT":
+                after_index += 1
+            after = tokens[after_index][1] if after_index < len(tokens) else None
+
+            if after in _EQUALITY_OPERATORS or before in ("=", "=="):
+                # The operand on the other side of the operator
+                other_index = (
+                    after_index + 1 if after in _EQUALITY_OPERATORS else start - 2
+                )
+                other_kind, other_text = (
+                    tokens[other_index]
+                    if 0 <= other_index < len(tokens)
+                    else (None, None)
+                )
+                is_join = other_kind in ("word", "quoted") and (
+                    other_text not in SQLITE_KEYWORDS
+                )
+                columns[table]["join" if is_join else "equality"][column] += 1
+            elif after in _RANGE_OPERATORS or before in _RANGE_OPERATORS:
+                columns[table]["range"][column] += 1
+        return aliases, columns
+
+    def candidates(
+        self,
+        conn: sqlite3.Connection,
+        queries: list[str],
+        schema: dict,
+        failed: Optional[list[int]] = None,
+        skipped: Optional[list[int]] = None,
+    ) -> list[dict]:
+        """Derives the candidate indexes of one database from its queries.
+
+        The positions of the queries which can not be planned are added to
+        `failed`, and those of the queries which are not read-only (they
+        would change the data of the copies measured) to `skipped`.
+        """
+        failed = failed if failed is not None else []
+        skipped = skipped if skipped is not None else []
+        found: dict[tuple, set] = defaultdict(set)
+        for query_index, sql in enumerate(queries):
+            try:
+                if not self.is_read_only(conn, sql):
+                    skipped.append(query_index)
+                    continue
+                plan_rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            except sqlite3.Error:
+                failed.append(query_index)
+                continue
+            facts = parse_query_plan(plan_rows)
+            aliases, predicates = self.predicate_columns(sql, schema)
+
+            # Plans name a loop by its alias when the table has one
+            scanned = {
+                aliases[loop["table"].lower()]
+                for loop in facts["loops"]
+                if loop["scan"] and loop["table"].lower() in aliases
+            }
+            for table in scanned:
+                equality, joins, ranges = (
+                    [c for c, _ in predicates[table][kind].most_common()]
+                    for kind in ("equality", "join", "range")
+                )
+                for column in equality + joins + ranges:
+                    found[(table, (column,))].add(query_index)
+
+                # Filters first, for the table read as the outer loop, and
+                # the join column first, for the table read as an inner loop
+                composites = [equality[: self.max_columns]]
+                if ranges and len(composites[0]) < self.max_columns:
+                    composites[0].append(ranges[0])
+                if joins:
+                    composites.append(
+                        [joins[0]] + [c for c in equality if c != joins[0]]
+                    )
+                for composite in composites:
+                    composite = tuple(dict.fromkeys(composite))[: self.max_columns]
+                    if len(composite) > 1:
+                        found[(table, composite)].add(query_index)
+
+            for detail in facts["details"]:
+                automatic = _AUTOMATIC_INDEX_PATTERN.search(detail)
+                loop = _LOOP_TABLE_PATTERN.match(detail)
+                if not automatic or not loop:
+                    continue
+                table = aliases.get(loop.group("table").lower())
+                if table is None:
+                    continue
+                auto_columns = tuple(
+                    re.split(r"[=<>]", part)[0].strip().lower()
+                    for part in automatic.group("columns").split(" AND ")
+                )
+                if all(column in schema[table]["columns"] for column in auto_columns):
+                    found[(table, auto_columns[: self.max_columns])].add(query_index)
+
+        candidates = []
+        for (table, columns), query_indices in found.items():
+            # An existing index already leads with these columns
+            if any(
+                index[: len(columns)] == columns for index in schema[table]["indexes"]
+            ):
+                continue
+            name = "premsql_advisor_" + _UNSAFE_NAME_CHARACTERS.sub(
+                "_", "_".join((schema[table]["name"],) + columns)
+            )
+            column_names = [schema[table]["columns"][column] for column in columns]
+            candidates.append(
+                {
+                    "name": name,
+                    "table": schema[table]["name"],
+                    "columns": column_names,
+                    "sql": "CREATE INDEX {} ON {} ({})".format(
+                        _quote_identifier(name),
+                        _quote_identifier(schema[table]["name"]),
+                        ", ".join(_quote_identifier(c) for c in column_names),
+                    ),
+                    "queries": sorted(query_indices),
+                }
+            )
+        candidates.sort(
+            key=lambda candidate: (-len(candidate["queries"]), candidate["name"])
+        )
+        return candidates[: self.max_candidates]
+
+    @staticmethod
+    def index_size(conn: sqlite3.Connection, name: str, used_pages_before: int) -> int:
+        """Size of an index in bytes, from dbstat or the growth of the used pages"""
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        try:
+            size = conn.execute(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", (name,)
+            ).fetchone()[0]
+            if size:
+                return size
+        except sqlite3.OperationalError:
+            # sqlite built without SQLITE_ENABLE_DBSTAT_VTAB
+            pass
+        return (IndexAdvisor._used_pages(conn) - used_pages_before) * page_size
+
+    @staticmethod
+    def _used_pages(conn: sqlite3.Connection) -> int:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return page_count - freelist_count
+
+    def advise_database(self, db_path: str, queries: list[str]) -> dict:
+        """Builds and measures the candidate indexes of one database"""
+        db_path = resolve_sqlite_path(db_path)
+        report = {
+            "db_path": db_path,
+            "num_queries": len(queries),
+            "failed_queries": [],
+            "skipped_queries": [],
+            "recommendations": [],
+        }
+        if not os.path.isfile(db_path):
+            report["error"] = f"{db_path} is not a sqlite database file"
+            return report
+
+        scratch_dir = tempfile.mkdtemp(prefix="premsql_index_", dir=self.scratch_dir)
+        original = self._connect(db_path, read_only=True)
+        scratch, baseline = None, None
+        try:
+            # Both sides are timed on copies in the same directory, the
+            # original may live on another disk with another cache state
+            name = os.path.basename(db_path)
+            scratch = self._connect(os.path.join(scratch_dir, f"indexed_{name}"))
+            baseline = self._connect(os.path.join(scratch_dir, f"baseline_{name}"))
+            original.backup(scratch)
+            original.backup(baseline)
+            schema = self._schema(original)
+            candidates = self.candidates(
+                original,
+                queries,
+                schema,
+                failed=report["failed_queries"],
+                skipped=report["skipped_queries"],
+            )
+            logger.info(f"{len(candidates)} candidate indexes for {db_path}")
+
+            for candidate in candidates:
+                used_pages_before = self._used_pages(scratch)
+                start_time = time.perf_counter()
+                scratch.execute(candidate["sql"])
+                scratch.commit()
+                build_time = time.perf_counter() - start_time
+                size = self.index_size(scratch, candidate["name"], used_pages_before)
+
+                recommendation = self._measure(
+                    candidate=candidate,
+                    queries=queries,
+                    baseline=baseline,
+                    scratch=scratch,
+                    failed=report["failed_queries"],
+                )
+                recommendation.update({"size_bytes": size, "build_time": build_time})
+                report["recommendations"].append(recommendation)
+
+                scratch.execute(f"DROP INDEX {_quote_identifier(candidate['name'])}")
+                scratch.commit()
+        finally:
+            original.close()
+            for conn in (scratch, baseline):
+                if conn is not None:
+                    conn.close()
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        report["failed_queries"] = sorted(set(report["failed_queries"]))
+        report["recommendations"].sort(key=lambda r: -r["time_saved"])
+        return report
+
+    def _measure(
+        self,
+        candidate: dict,
+        queries: list[str],
+        baseline: sqlite3.Connection,
+        scratch: sqlite3.Connection,
+        failed: list[int],
+    ) -> dict:
+        # Only the queries whose plan picks up the index are replayed
+        using_index = []
+        for query_index in candidate["queries"]:
+            sql = queries[query_index]
+            plan_rows = scratch.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            details = " ".join(parse_query_plan(plan_rows)["details"])
+            if candidate["name"] in details and query_index not in failed:
+                using_index.append(query_index)
+
+        baseline_time, indexed_time, per_query = 0.0, 0.0, []
+        for query_index in using_index:
+            sql = queries[query_index]
+            try:
+                timing = self.timing_harness.measure(
+                    run_predicted=lambda: self._run(scratch, sql),
+                    run_gold=lambda: self._run(baseline, sql),
+                    num_iterations=self.num_iterations,
+                )
+            except (QueryTimeout, sqlite3.Error) as e:
+                logger.info(f"Skipping query {query_index}: {type(e).__name__} {e}")
+                failed.append(query_index)
+                continue
+            baseline_time += timing["gold_time_median"]
+            indexed_time += timing["predicted_time_median"]
+            per_query.append(
+                {
+                    "query": query_index,
+                    "speedup": timing["ratio"],
+                    "speedup_ci": timing["ratio_ci"],
+                }
+            )
+
+        return {
+            "sql": candidate["sql"],
+            "table": candidate["table"],
+            "columns": candidate["columns"],
+            "num_queries_using": len(per_query),
+            "baseline_time": baseline_time,
+            "indexed_time": indexed_time,
+            "time_saved": baseline_time - indexed_time,
+            "speedup": baseline_time / indexed_time if indexed_time > 0 else 1.0,
+            "per_query": per_query,
+        }
+
+    def advise(self, workload: list[tuple[str, str]]) -> list[dict]:
+        """Returns one report per database of a list of (sql, dsn_or_db_path)"""
+        groups = group_by_database([dsn_or_db_path for _, dsn_or_db_path in workload])
+        return [
+            self.advise_database(
+                db_path=dsn_or_db_path, queries=[workload[i][0] for i in indices]
+            )
+            for dsn_or_db_path, indices in groups.items()
+        ]
@@ -0,0 +1,246 @@
+import bisect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator, Literal, Optional, Sequence, Union
+
+from premsql.executors.columnar import approximate_size
+from premsql.executors.compare import normalize_row
+
+PHASES = ("connect", "plan", "execute", "fetch", "total")
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class QueryTrace:
+    """Timings (in seconds) and result size of a single query"""
+
+    def __init__(self, count_bytes: Optional[bool] = True) -> None:
+        self.count_bytes = count_bytes
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.rows = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.timings[phase] += seconds
+
+    @contextmanager
+    def phase(self, phase: str) -> Generator[None, None, None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start_time)
+
+    def add_rows(self, rows: Sequence) -> None:
+        self.rows += len(rows)
+        if self.count_bytes:
+            self.bytes += sum(
+                approximate_size(value) for row in rows for value in normalize_row(row)
+            )
+
+    def to_dict(self) -> dict:
+        return {
+            "timings": dict(self.timings),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "error": self.error,
+        }
+
+
+class MetricsCollector:
+    """Aggregates query traces into histograms per database.
+
+    The last `max_records` traces are also kept as they are. The metrics can
+    be dumped as JSON, or in the Prometheus text format to be scraped.
+    """
+
+    def __init__(
+        self,
+        buckets: Optional[Sequence[float]] = DEFAULT_BUCKETS,
+        max_records: Optional[int] = 10000,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._databases: dict[str, dict] = {}
+            self._records = deque(maxlen=self.max_records)
+
+    def _new_database(self) -> dict:
+        return {
+            "queries": 0,
+            "errors": 0,
+            "rows": 0,
+            "bytes": 0,
+            "phases": {
+                phase: {"count": 0, "sum": 0.0, "counts": [0] * (len(self.buckets) + 1)}
+                for phase in PHASES
+            },
+        }
+
+    def record(self, dsn_or_db_path: str, trace: QueryTrace) -> None:
+        database = str(dsn_or_db_path)
+        with self._lock:
+            stats = self._databases.get(database)
+            if stats is None:
+                stats = self._databases[database] = self._new_database()
+
+            stats["queries"] += 1
+            stats["errors"] += trace.error is not None
+            stats["rows"] += trace.rows
+            stats["bytes"] += trace.bytes
+            for phase, seconds in trace.timings.items():
+                histogram = stats["phases"][phase]
+                histogram["count"] += 1
+                histogram["sum"] += seconds
+                histogram["counts"][bisect.bisect_left(self.buckets, seconds)] += 1
+
+            self._records.append({"database": database, **trace.to_dict()})
+
+    def merge(self, other: "MetricsCollector") -> None:
+        """Adds the metrics of another collector, e.g. one of a worker process"""
+        assert other.buckets == self.buckets, "Both collectors need the same buckets"
+        with other._lock:
+            databases = {
+                database: {
+                    **stats,
+                    "phases": {
+                        phase: {**histogram, "counts": list(histogram["counts"])}
+                        for phase, histogram in stats["phases"].items()
+                    },
+                }
+                for database, stats in other._databases.items()
+            }
+            records = list(other._records)
+
+        with self._lock:
+            for database, other_stats in databases.items():
+                stats = self._databases.get(database)
+                if stats is None:
+                    self._databases[database] = other_stats
+                    continue
+                for key in ("queries", "errors", "rows", "bytes"):
+                    stats[key] += other_stats[key]
+                for phase, histogram in stats["phases"].items():
+                    other_histogram = other_stats["phases"][phase]
+                    histogram["count"] += other_histogram["count"]
+                    histogram["sum"] += other_histogram["sum"]
+                    histogram["counts"] = [
+                        a + b
+                        for a, b in zip(histogram["counts"], other_histogram["counts"])
+                    ]
+            self._records.extend(records)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = {}
+            for database, stats in self._databases.items():
+                phases = {}
+                for phase, histogram in stats["phases"].items():
+                    cumulative = self._cumulative(histogram["counts"])
+                    phases[phase] = {
+                        "count": histogram["count"],
+                        "sum": histogram["sum"],
+                        "mean": histogram["sum"] / max(histogram["count"], 1),
+                        "buckets": {
+                            le: count
+                            for le, count in zip(self._bucket_labels(), cumulative)
+                        },
+                    }
+                summary[database] = {
+                    "queries": stats["queries"],
+                    "errors": stats["errors"],
+                    "rows": stats["rows"],
+                    "bytes": stats["bytes"],
+                    "phases": phases,
+                }
+            return summary
+
+    @property
+    def records(self) -> list[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def to_prometheus(self) -> str:
+        summary = self.summary()
+        lines = [
+            "# HELP premsql_query_duration_seconds Time spent per query phase",
+            "# TYPE premsql_query_duration_seconds histogram",
+        ]
+        for database, stats in summary.items():
+            db_label = _escape_label(database)
+            for phase, histogram in stats["phases"].items():
+                labels = f'database="{db_label}",phase="{phase}"'
+                for le, count in histogram["buckets"].items():
+                    lines.append(
+                        f'premsql_query_duration_seconds_bucket{{{labels},le="{le}"}} {count}'
+                    )
+                lines.append(
+                    f"premsql_query_duration_seconds_sum{{{labels}}} {histogram['sum']}"
+                )
+                lines.append(
+                    f"premsql_query_duration_seconds_count{{{labels}}} {histogram['count']}"
+                )
+
+        for name, key, description in [
+            ("premsql_queries_total", "queries", "Number of executed queries"),
+            ("premsql_query_errors_total", "errors", "Number of failed queries"),
+            ("premsql_query_rows_total", "rows", "Number of fetched rows"),
+            ("premsql_query_bytes_total", "bytes", "Approximate size of fetched rows"),
+        ]:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for database, stats in summary.items():
+                lines.append(
+                    f'{name}{{database="{_escape_label(database)}"}} {stats[key]}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def dump(
+        self,
+        path: Union[str, Path],
+        format: Optional[Literal["json", "prometheus"]] = "json",
+    ) -> None:
+        assert format in ["json", "prometheus"], "format should be json or prometheus"
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if format == "prometheus":
+            path.write_text(self.to_prometheus())
+            return
+        with open(path, "w") as json_file:
+            json.dump(
+                {"databases": self.summary(), "queries": self.records},
+                json_file,
+                indent=4,
+            )
+
+    def _bucket_labels(self) -> list[str]:
+        return [str(bucket) for bucket in self.buckets] + ["+Inf"]
+
+    @staticmethod
+    def _cumulative(counts: list[int]) -> list[int]:
+        cumulative, total = [], 0
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
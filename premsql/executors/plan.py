@@ -0,0 +1,171 @@
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from premsql.sql import SQLITE_KEYWORDS, fingerprint, tokenize
+
+# Matches both the current ("SCAN a") and the pre 3.36 ("SCAN TABLE t AS a")
+# formats of the EXPLAIN QUERY PLAN details. Current versions print only the
+# alias of an aliased table, so `table` holds the alias there; resolve it
+# with `table_aliases`.
+_LOOP_PATTERN = re.compile(
+    r"^(?P<op>SCAN|SEARCH)\s+(?:TABLE\s+|SUBQUERY\s+)?(?P<table>\S+)"
+    r"(?:\s+AS\s+(?P<alias>\S+))?(?:\s+USING\s+(?P<using>.*))?$"
+)
+_INDEX_PATTERN = re.compile(
+    r"^(?P<covering>AUTOMATIC\s+COVERING\s+|AUTOMATIC\s+PARTIAL\s+COVERING\s+|COVERING\s+|AUTOMATIC\s+)?"
+    r"INDEX\s*(?P<index>[^\s(]*)"
+)
+_TEMP_BTREE_PATTERN = re.compile(r"^USE TEMP B-TREE FOR (?P<purpose>.*)$")
+_SUBQUERY_PATTERN = re.compile(
+    r"^(CORRELATED\s+)?(SCALAR|LIST)\s+SUBQUERY|^MATERIALIZE|^CO-ROUTINE"
+)
+
+
+def table_aliases(sql: str, tables: dict) -> dict:
+    """Maps every alias (and name) of the given tables in a query to its table.
+
+    `tables` is keyed by the lowercased table names of the database, the keys
+    and values of the result are lowercased too.
+    """
+    tokens = list(tokenize(sql))
+    names = [
+        (
+            (text[1:-1] if kind == "quoted" else text).lower()
+            if kind in ("word", "quoted")
+            else None
+        )
+        for kind, text in tokens
+    ]
+
+    aliases = {}
+    for index, name in enumerate(names):
+        if name not in tables:
+            continue
+        aliases[name] = name
+        following = index + 1
+        if following + 1 < len(tokens) and tokens[following][1].upper() == "AS":
+            following += 1
+        if following >= len(tokens):
+            continue
+        kind, text = tokens[following]
+        if kind == "quoted" or (kind == "word" and text.upper() not in SQLITE_KEYWORDS):
+            aliases[names[following]] = name
+    return aliases
+
+
+def parse_query_plan(plan_rows: list) -> dict:
+    """Turns the rows of EXPLAIN QUERY PLAN into structured plan facts.
+
+    `join_order` lists the tables in the nesting order of the loops chosen
+    by the planner, `scans` the tables read without any index. `loops` has
+    the table (the alias of an aliased table on sqlite 3.36 and later),
+    alias, access (scan or search) and parent node of every loop; loops
+    sharing a parent are nested within one join.
+    """
+    facts = {
+        "loops": [],
+        "scans": [],
+        "index_usage": [],
+        "automatic_indexes": [],
+        "temp_btrees": [],
+        "join_order": [],
+        "subqueries": 0,
+        "details": [],
+    }
+
+    for row in plan_rows:
+        detail = str(row[-1])
+        facts["details"].append(detail)
+
+        loop = _LOOP_PATTERN.match(detail)
+        if loop and detail != "SCAN CONSTANT ROW":
+            table = loop.group("alias") or loop.group("table")
+            facts["join_order"].append(table)
+            using = loop.group("using")
+            index = _INDEX_PATTERN.match(using) if using else None
+            facts["loops"].append(
+                {
+                    "table": loop.group("table"),
+                    "alias": loop.group("alias"),
+                    "scan": loop.group("op") == "SCAN" or not using,
+                    "parent": row[1] if len(row) > 1 else 0,
+                }
+            )
+
+            if using and "PRIMARY KEY" in using:
+                facts["index_usage"].append(
+                    {"table": table, "index": "PRIMARY KEY", "covering": False}
+                )
+            elif index:
+                kind = index.group("covering") or ""
+                if "AUTOMATIC" in kind:
+                    facts["automatic_indexes"].append(table)
+                facts["index_usage"].append(
+                    {
+                        "table": table,
+                        "index": index.group("index") or "AUTOMATIC",
+                        "covering": "COVERING" in kind,
+                    }
+                )
+            else:
+                facts["scans"].append(table)
+            continue
+
+        temp_btree = _TEMP_BTREE_PATTERN.match(detail)
+        if temp_btree:
+            facts["temp_btrees"].append(temp_btree.group("purpose"))
+        elif _SUBQUERY_PATTERN.match(detail):
+            facts["subqueries"] += 1
+
+    return facts
+
+
+class QueryPlanInspector:
+    """Inspects sqlite query plans and caches the facts per db and SQL.
+
+    The plan of the same query on the same database does not change during
+    a run, so `EXPLAIN QUERY PLAN` runs once per distinct canonical SQL.
+    """
+
+    def __init__(self, max_entries: Optional[int] = 4096) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans: OrderedDict[tuple, Optional[dict]] = OrderedDict()
+
+    def inspect(
+        self, conn: sqlite3.Connection, db_path: str, sql: str
+    ) -> Optional[dict]:
+        """Returns the plan facts, or None when the SQL can not be planned"""
+        key = (db_path, fingerprint(sql))
+        with self._lock:
+            if key in self._plans:
+                self._plans.move_to_end(key)
+                return self._plans[key]
+
+        try:
+            plan_rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            facts = parse_query_plan(plan_rows)
+        except sqlite3.Error:
+            facts = None
+
+        with self._lock:
+            self._plans[key] = facts
+            if len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return facts
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Generator, Optional
+
+from premsql.logger import setup_console_logger
+from premsql.utils import convert_sqlite_dsn_to_path
+
+logger = setup_console_logger(name="[SQLITE-POOL]")
+
+
+def resolve_sqlite_path(dsn_or_db_path: str) -> str:
+    """Returns the absolute file path for a sqlite path or a sqlite:/// DSN"""
+    return os.path.abspath(convert_sqlite_dsn_to_path(dsn_or_db_path))
+
+
+def default_sqlite_connect(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(db_path, check_same_thread=False)
+
+
+class SQLiteConnectionPool:
+    """Thread-safe pool of sqlite connections keyed by the resolved db path.
+
+    Every database gets its own bounded queue of idle connections. A checked
+    out connection is used by a single thread at a time; when the idle queue
+    of a database is full, the returned connection is closed instead of kept.
+    Connections which stayed idle longer than `idle_timeout` seconds are
+    evicted on the next checkout. A returned connection for which
+    `validate_fn(db_path, conn)` is False is closed instead of kept.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = 4,
+        idle_timeout: Optional[float] = 300.0,
+        connect_fn: Optional[Callable[[str], sqlite3.Connection]] = None,
+        validate_fn: Optional[Callable[[str, sqlite3.Connection], bool]] = None,
+    ) -> None:
+        assert max_size > 0, "max_size should be greater than 0"
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_fn = connect_fn or default_sqlite_connect
+        self.validate_fn = validate_fn
+
+        self._lock = threading.Lock()
+        self._idle: dict[str, deque] = defaultdict(deque)
+        self._num_created = 0
+        self._num_reused = 0
+
+    @contextmanager
+    def connection(self, dsn_or_db_path: str) -> Generator[sqlite3.Connection, None, None]:
+        db_path = resolve_sqlite_path(dsn_or_db_path)
+        conn = self.acquire(db_path)
+        try:
+            yield conn
+        except BaseException:
+            self.release(db_path, conn, discard=not self._is_healthy(conn))
+            raise
+        else:
+            self.release(db_path, conn)
+
+    def acquire(self, db_path: str) -> sqlite3.Connection:
+        self.evict_idle()
+        with self._lock:
+            idle = self._idle.get(db_path)
+            if idle:
+                conn, _ = idle.pop()
+                self._num_reused += 1
+                return conn
+            self._num_created += 1
+        return self.connect_fn(db_path)
+
+    def release(
+        self, db_path: str, conn: sqlite3.Connection, discard: Optional[bool] = False
+    ) -> None:
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        if not discard and self.validate_fn is not None:
+            discard = not self.validate_fn(db_path, conn)
+
+        with self._lock:
+            idle = self._idle[db_path]
+            if not discard and len(idle) < self.max_size:
+                idle.append((conn, time.monotonic()))
+                return
+        self._close(conn)
+
+    def evict_idle(self) -> int:
+        if self.idle_timeout is None:
+            return 0
+
+        now, to_close = time.monotonic(), []
+        with self._lock:
+            for db_path in list(self._idle.keys()):
+                idle = self._idle[db_path]
+                while idle and now - idle[0][1] > self.idle_timeout:
+                    to_close.append(idle.popleft()[0])
+                if not idle:
+                    del self._idle[db_path]
+
+        for conn in to_close:
+            self._close(conn)
+        return len(to_close)
+
+    def close(self, dsn_or_db_path: str) -> None:
+        """Closes all the idle connections of a single database"""
+        db_path = resolve_sqlite_path(dsn_or_db_path)
+        with self._lock:
+            idle = self._idle.pop(db_path, deque())
+        for conn, _ in idle:
+            self._close(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle_queues = list(self._idle.values())
+            self._idle.clear()
+        for idle in idle_queues:
+            for conn, _ in idle:
+                self._close(conn)
+
+    def __getstate__(self) -> dict:
+        # Connections stay in the process which opened them
+        state = self.__dict__.copy()
+        del state["_lock"], state["_idle"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._idle = defaultdict(deque)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "created": self._num_created,
+                "reused": self._num_reused,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+            }
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _close(conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Unable to close sqlite connection: {e}")
@@ -0,0 +1,265 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import Any, Optional, Type
+
+from premsql.executors.base import BaseExecutor
+from premsql.executors.from_sqlite import SQLiteExecutor
+from premsql.logger import setup_console_logger
+
+logger = setup_console_logger(name="[SANDBOX-EXEC]")
+
+try:
+    import resource
+except ImportError:
+    resource = None
+    logger.warning("resource is not available, sandbox workers run without rlimits")
+
+
+def _cpu_time_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _limit_cpu_time(seconds: float) -> None:
+    # RLIMIT_CPU counts the CPU time of the whole process, so the soft limit
+    # is moved forward before every query. Crossing it raises SIGXCPU.
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(_cpu_time_used() + seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _is_out_of_memory(result: Any) -> bool:
+    error = result.get("error") if isinstance(result, dict) else None
+    return isinstance(error, str) and (
+        "out of memory" in error.lower() or error == "MemoryError"
+    )
+
+
+def _worker_main(
+    conn,
+    executor_class: Type[BaseExecutor],
+    executor_kwargs: dict,
+    cpu_time_limit: Optional[float],
+    memory_limit_mb: Optional[float],
+) -> None:
+    if resource is not None and memory_limit_mb is not None:
+        limit = int(memory_limit_mb * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    executor = executor_class(**executor_kwargs)
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+
+        method, kwargs = request
+        if resource is not None and cpu_time_limit is not None:
+            _limit_cpu_time(cpu_time_limit)
+        try:
+            result = getattr(executor, method)(**kwargs)
+            response = ("killed", "memory") if _is_out_of_memory(result) else ("ok", result)
+        except MemoryError:
+            response = ("killed", "memory")
+        except Exception as e:
+            response = ("error", f"Exception: {e}")
+        conn.send(response)
+    executor.close()
+
+
+class _Worker:
+    def __init__(self, context, **worker_kwargs) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn,), kwargs=worker_kwargs, daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.num_queries = 0
+
+    def call(self, method: str, kwargs: dict, timeout: Optional[float]) -> tuple:
+        self.num_queries += 1
+        self.conn.send((method, kwargs))
+        if not self.conn.poll(timeout):
+            self.kill()
+            return ("killed", "timeout")
+        try:
+            return self.conn.recv()
+        except EOFError:
+            self.process.join()
+            return ("killed", self._exit_reason())
+
+    def _exit_reason(self) -> str:
+        exitcode = self.process.exitcode
+        if exitcode == -signal.SIGXCPU:
+            return "cpu"
+        # The kernel OOM killer and failed allocations end with SIGKILL or a
+        # non zero exit code
+        if exitcode == -signal.SIGKILL or (exitcode or 0) > 0:
+            return "memory"
+        return f"signal {-exitcode}" if exitcode else "unknown"
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self) -> None:
+        if self.is_alive:
+            try:
+                self.conn.send(None)
+                self.process.join(timeout=1)
+            except (BrokenPipeError, OSError):
+                pass
+        self.kill()
+
+    def kill(self) -> None:
+        if self.is_alive:
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxedExecutor(BaseExecutor):
+    """Runs every query in a pool of pre-forked worker processes.
+
+    Each worker builds its own `executor_class(**executor_kwargs)` and runs
+    with a CPU time limit per query (`RLIMIT_CPU`) and an address space
+    limit (`RLIMIT_AS`), so a runaway query only takes down its worker. A
+    worker is replaced after `max_queries_per_worker` queries or when it
+    dies, and the query gets a "killed: cpu", "killed: memory" or
+    "killed: timeout" (wall clock `timeout`) error.
+
+    The rlimits need the `resource` module (unix only); elsewhere only the
+    wall clock timeout is enforced. A pickled copy (e.g. in the processes of
+    a parallel evaluation) starts a worker pool of its own on first use.
+    """
+
+    def __init__(
+        self,
+        executor_class: Optional[Type[BaseExecutor]] = SQLiteExecutor,
+        executor_kwargs: Optional[dict] = None,
+        num_workers: Optional[int] = 2,
+        max_queries_per_worker: Optional[int] = 100,
+        cpu_time_limit: Optional[float] = 30.0,
+        memory_limit_mb: Optional[float] = 2048,
+        timeout: Optional[float] = None,
+    ) -> None:
+        assert num_workers > 0, "num_workers should be greater than 0"
+        self.num_workers = num_workers
+        self.max_queries_per_worker = max_queries_per_worker
+        self.timeout = timeout
+        self.max_concurrency_per_db = num_workers
+        self._worker_kwargs = {
+            "executor_class": executor_class,
+            "executor_kwargs": executor_kwargs or {},
+            "cpu_time_limit": cpu_time_limit,
+            "memory_limit_mb": memory_limit_mb,
+        }
+
+        self._pool_lock = threading.Lock()
+        self._idle: Optional[queue.Queue] = None
+        self._start_pool()
+        self.num_killed = 0
+
+    def _start_pool(self) -> None:
+        with self._pool_lock:
+            if self._idle is not None:
+                return
+            methods = multiprocessing.get_all_start_methods()
+            self._context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            idle = queue.Queue()
+            for _ in range(self.num_workers):
+                idle.put(self._start_worker())
+            self._idle = idle
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        del state["_pool_lock"]
+        state.pop("_context", None)
+        state["_idle"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # Processes can not be started while unpickling, the pool is started
+        # by the first query
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+
+    def _start_worker(self) -> _Worker:
+        return _Worker(self._context, **self._worker_kwargs)
+
+    def _call(self, method: str, failed_result: Any, **kwargs) -> dict:
+        start_time = time.time()
+        self._start_pool()
+        worker = self._idle.get()
+        healthy = False
+        try:
+            status, response = worker.call(method, kwargs, timeout=self.timeout)
+            healthy = status != "killed"
+        finally:
+            # The worker is replaced when it died, was killed or was left in
+            # an unknown state by an exception in this thread
+            if not healthy or worker.num_queries >= self.max_queries_per_worker:
+                worker.stop()
+                worker = self._start_worker()
+            self._idle.put(worker)
+
+        if status == "ok":
+            return response
+
+        if status == "killed":
+            self.num_killed += 1
+            response = f"killed: {response}"
+            logger.warning(f"Sandbox worker {response} while running {method}")
+        return {
+            "result": failed_result,
+            "error": response,
+            "execution_time": time.time() - start_time,
+        }
+
+    def execute_sql(self, sql: str, dsn_or_db_path: str) -> dict:
+        return self._call("execute_sql", None, sql=sql, dsn_or_db_path=dsn_or_db_path)
+
+    def match_sqls(
+        self, predicted_sql: str, gold_sql: str, dsn_or_db_path: str
+    ) -> dict:
+        # Both results are compared inside the worker, only the verdict is
+        # sent back
+        return self._call(
+            "match_sqls",
+            0,
+            predicted_sql=predicted_sql,
+            gold_sql=gold_sql,
+            dsn_or_db_path=dsn_or_db_path,
+        )
+
+    def iterated_execution(
+        self,
+        predicted_sql: str,
+        gold_sql: str,
+        dsn_or_db_path: str,
+        num_iterations: int,
+    ) -> dict:
+        return self._call(
+            "iterated_execution",
+            0,
+            predicted_sql=predicted_sql,
+            gold_sql=gold_sql,
+            dsn_or_db_path=dsn_or_db_path,
+            num_iterations=num_iterations,
+        )
+
+    def close(self) -> None:
+        if self._idle is None:
+            return
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
@@ -0,0 +1,183 @@
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Literal, Optional
+
+from sqlalchemy.engine import Engine
+
+from premsql.executors.plan import QueryPlanInspector, table_aliases
+from premsql.logger import setup_console_logger
+
+logger = setup_console_logger(name="[COST-SCREEN]")
+
+_AGGREGATE_PATTERN = re.compile(
+    r"\b(COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(", re.IGNORECASE
+)
+
+
+class QueryCostScreen:
+    """Estimates the cost of a generated query on sqlite before it runs.
+
+    The loops of one join are nested, so the cost of a join is the product
+    of the row counts of the tables it reads with a full scan (tables read
+    through an index count as one row). The row counts are looked up once
+    per database. Queries above `max_cost` row reads are rejected with a
+    reason meant to be fed back to the generator. With `action="limit"`
+    they are wrapped in `SELECT * FROM (...) LIMIT limit_rows` instead,
+    when the plan can stop early (no sorting, grouping or aggregates).
+
+    Executors screen the queries of `execute_sql`, whose result reports the
+    decision under `"screen"`, and the predicted query of `match_sqls`,
+    where a query over the limit is always rejected since a limited result
+    can not be compared. `stream_sql`, `fetch_columnar` and `spool_sql` are
+    not screened: their callers bound the rows they read themselves.
+    """
+
+    def __init__(
+        self,
+        max_cost: Optional[float] = 1e8,
+        action: Optional[Literal["reject", "limit"]] = "reject",
+        limit_rows: Optional[int] = 1000,
+        plan_inspector: Optional[QueryPlanInspector] = None,
+    ) -> None:
+        assert action in ["reject", "limit"], "action should be reject or limit"
+        self.max_cost = max_cost
+        self.action = action
+        self.limit_rows = limit_rows
+        self.plan_inspector = plan_inspector or QueryPlanInspector()
+
+        self._lock = threading.Lock()
+        self._row_counts: dict[str, dict[str, int]] = {}
+
+    def table_row_counts(self, conn: sqlite3.Connection, db_path: str) -> dict:
+        with self._lock:
+            if db_path in self._row_counts:
+                return self._row_counts[db_path]
+
+        row_counts = {}
+        tables = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        for (table,) in tables:
+            quoted = '"{}"'.format(table.replace('"', '""'))
+            try:
+                # MAX(rowid) is a single index lookup, close to the row count
+                # of tables without many deletions
+                count = conn.execute(f"SELECT MAX(rowid) FROM {quoted}").fetchone()[0]
+            except sqlite3.OperationalError:
+                # WITHOUT ROWID tables
+                count = conn.execute(f"SELECT COUNT(*) FROM {quoted}").fetchone()[0]
+            row_counts[table.lower()] = count or 0
+
+        with self._lock:
+            self._row_counts[db_path] = row_counts
+        return row_counts
+
+    def estimate_cost(
+        self, facts: dict, row_counts: dict, aliases: Optional[dict] = None
+    ) -> tuple[float, list[str]]:
+        """Returns the estimated row reads and the tables scanned in nested loops.
+
+        `aliases` maps the lowercased aliases of the query to their tables,
+        since sqlite names an aliased table by its alias in the plan.
+        """
+        aliases = aliases or {}
+        joins = defaultdict(list)
+        for loop in facts.get("loops", []):
+            joins[loop["parent"]].append(loop)
+
+        total_cost, nested_scans = 0.0, []
+        for loops in joins.values():
+            cost, scans = 1.0, []
+            for loop in loops:
+                if loop["scan"]:
+                    name = loop["table"].lower()
+                    table = aliases.get(name, name)
+                    rows = row_counts.get(table, 1)
+                    cost *= max(rows, 1)
+                    label = (
+                        loop["table"]
+                        if table == name
+                        else f"{table} AS {loop['table']}"
+                    )
+                    scans.append(f"{label} ({rows:,} rows)")
+            total_cost += cost
+            if len(scans) > 1:
+                nested_scans.extend(scans)
+        return total_cost, nested_scans
+
+    def screen(
+        self,
+        conn: sqlite3.Connection,
+        db_path: str,
+        sql: str,
+        action: Optional[Literal["reject", "limit"]] = None,
+    ) -> dict:
+        """Returns the SQL to run (possibly limited) or the rejection reason.
+
+        `action` overrides the action of the screen for this query.
+        """
+        action = action or self.action
+        decision = {"sql": sql, "error": None, "estimated_cost": None, "action": "allow"}
+        facts = self.plan_inspector.inspect(conn=conn, db_path=db_path, sql=sql)
+        if facts is None:
+            # SQL errors are reported by the execution itself
+            return decision
+
+        row_counts = self.table_row_counts(conn=conn, db_path=db_path)
+        cost, nested_scans = self.estimate_cost(
+            facts=facts,
+            row_counts=row_counts,
+            aliases=table_aliases(sql, row_counts),
+        )
+        decision["estimated_cost"] = cost
+        if cost <= self.max_cost:
+            return decision
+
+        can_stop_early = not facts["temp_btrees"] and not _AGGREGATE_PATTERN.search(sql)
+        if action == "limit" and can_stop_early:
+            decision["sql"] = (
+                f"SELECT * FROM ({sql.strip().rstrip(';')}) LIMIT {self.limit_rows}"
+            )
+            decision["action"] = "limit"
+            logger.info(f"Limited a query with an estimated cost of {cost:.2e}")
+            return decision
+
+        reason = (
+            f"Query rejected before execution: it would read about {cost:.2e} rows, "
+            f"more than the limit of {self.max_cost:.2e}."
+        )
+        if nested_scans:
+            reason += (
+                " These tables are fully scanned inside each other, without a join"
+                f" condition on an index: {', '.join(nested_scans)}."
+            )
+        reason += " Add join conditions or filters to the query."
+        decision["error"], decision["action"] = reason, "reject"
+        return decision
+
+    def screen_engine(self, engine: Engine, sql: str) -> dict:
+        """Screens a query for a SQLAlchemy engine, other databases than sqlite pass"""
+        if engine.dialect.name != "sqlite":
+            return {"sql": sql, "error": None, "estimated_cost": None, "action": "allow"}
+
+        with engine.connect() as conn:
+            dbapi_conn = conn.connection.dbapi_connection
+            return self.screen(
+                conn=dbapi_conn, db_path=str(engine.url.database), sql=sql
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._row_counts.clear()
+        self.plan_inspector.clear()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
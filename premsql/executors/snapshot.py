@@ -0,0 +1,171 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from premsql.logger import setup_console_logger
+
+logger = setup_console_logger(name="[SQLITE-SNAPSHOT]")
+
+
+class SnapshotConnection(sqlite3.Connection):
+    """Connection on a snapshot, tagged with the generation it was opened on"""
+
+    snapshot_generation: Optional[int] = None
+
+
+class SQLiteSnapshotStore:
+    """Keeps read-only evaluation databases as shared in-memory snapshots.
+
+    Each database file is copied once into a named `:memory:` database with
+    the sqlite backup API. The snapshot is shared (cache=shared) by every
+    connection opened on its URI and stays alive as long as the store holds
+    its keeper connection. Whole databases are evicted in least recently
+    used order once the memory budget is exceeded; databases larger than
+    the budget are served from disk. An evicted snapshot is only freed once
+    its last connection is closed, so connections opened with `connect`
+    carry the generation of their snapshot and `is_current` tells whether
+    they should be closed rather than reused.
+    """
+
+    def __init__(
+        self,
+        memory_budget_mb: Optional[float] = 2048,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self.on_evict = on_evict
+
+        self._lock = threading.Lock()
+        self._snapshots: OrderedDict[str, dict] = OrderedDict()
+        self._generation = itertools.count()
+        self.used_bytes = 0
+        self.num_loads, self.num_evictions = 0, 0
+
+    def acquire_uri(self, db_path: str) -> Optional[str]:
+        """Returns the URI of the snapshot, loading it if needed.
+
+        Returns None when the database can not be held in memory.
+        """
+        snapshot = self._acquire(db_path)
+        return snapshot["uri"] if snapshot is not None else None
+
+    def connect(self, db_path: str, **connect_kwargs) -> Optional[SnapshotConnection]:
+        """Opens a connection on the snapshot, None when it is not in memory"""
+        snapshot = self._acquire(db_path)
+        if snapshot is None:
+            return None
+        conn = sqlite3.connect(
+            snapshot["uri"],
+            uri=True,
+            check_same_thread=False,
+            factory=SnapshotConnection,
+            **connect_kwargs,
+        )
+        conn.snapshot_generation = snapshot["generation"]
+        return conn
+
+    def is_current(self, db_path: str, conn: sqlite3.Connection) -> bool:
+        """False for a connection on a snapshot since evicted or replaced"""
+        generation = getattr(conn, "snapshot_generation", None)
+        if generation is None:
+            return True
+        with self._lock:
+            snapshot = self._snapshots.get(db_path)
+            return snapshot is not None and snapshot["generation"] == generation
+
+    def _acquire(self, db_path: str) -> Optional[dict]:
+        with self._lock:
+            snapshot = self._snapshots.get(db_path)
+            if snapshot is not None:
+                self._snapshots.move_to_end(db_path)
+                return snapshot
+
+            if not os.path.isfile(db_path):
+                return None
+            size = os.path.getsize(db_path)
+            if size > self.memory_budget_bytes:
+                logger.info(f"{db_path} is bigger than the memory budget, using disk")
+                return None
+
+            evicted = self._evict_until(self.memory_budget_bytes - size)
+            snapshot = self._load(db_path=db_path, size=size)
+            self._snapshots[db_path] = snapshot
+            self.used_bytes += size
+
+        for evicted_path in evicted:
+            if self.on_evict is not None:
+                self.on_evict(evicted_path)
+        return snapshot
+
+    def touch(self, db_path: str) -> None:
+        with self._lock:
+            if db_path in self._snapshots:
+                self._snapshots.move_to_end(db_path)
+
+    def _load(self, db_path: str, size: int) -> dict:
+        name = hashlib.sha1(db_path.encode()).hexdigest()[:16]
+        generation = next(self._generation)
+        uri = f"file:premsql_{name}_{generation}?mode=memory&cache=shared"
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            source.backup(keeper)
+        finally:
+            source.close()
+
+        self.num_loads += 1
+        logger.info(f"Loaded {db_path} in memory ({size / (1024 * 1024):.1f} MB)")
+        return {"uri": uri, "keeper": keeper, "size": size, "generation": generation}
+
+    def _evict_until(self, max_bytes: int) -> list[str]:
+        evicted = []
+        while self._snapshots and self.used_bytes > max_bytes:
+            db_path, snapshot = self._snapshots.popitem(last=False)
+            snapshot["keeper"].close()
+            self.used_bytes -= snapshot["size"]
+            self.num_evictions += 1
+            evicted.append(db_path)
+        return evicted
+
+    def evict(self, db_path: str) -> None:
+        with self._lock:
+            snapshot = self._snapshots.pop(db_path, None)
+            if snapshot is None:
+                return
+            snapshot["keeper"].close()
+            self.used_bytes -= snapshot["size"]
+            self.num_evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(db_path)
+
+    def close_all(self) -> None:
+        for db_path in list(self._snapshots.keys()):
+            self.evict(db_path)
+
+    def __getstate__(self) -> dict:
+        # Snapshots live in the memory of this process, other processes
+        # load their own
+        state = self.__dict__.copy()
+        del state["_lock"], state["_snapshots"], state["_generation"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+        self._generation = itertools.count()
+        self.used_bytes = 0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "databases": len(self._snapshots),
+                "used_mb": self.used_bytes / (1024 * 1024),
+                "loads": self.num_loads,
+                "evictions": self.num_evictions,
+            }
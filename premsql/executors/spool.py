@@ -0,0 +1,300 @@
+import os
+import tempfile
+import threading
+import uuid
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, Optional, Sequence, Union
+
+import pandas as pd
+
+from premsql.logger import setup_console_logger
+
+logger = setup_console_logger(name="[RESULT-SPOOLER]")
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    logger.warn("Ensure pyarrow is installed to spool results to disk")
+    logger.warn("Install it by: pip install pyarrow")
+
+_SUFFIXES = {"arrow": ".arrow", "parquet": ".parquet"}
+
+
+def _column_array(values: list, field: Optional["pa.Field"] = None) -> "pa.Array":
+    """Converts a column of python values, to the type of `field` when given"""
+    if field is None:
+        array = pa.array(values)
+        if pa.types.is_null(array.type):
+            # Nothing to infer a type from, keep the values as text
+            return pa.array(values, type=pa.string())
+        if pa.types.is_decimal(array.type):
+            # The precision is inferred from the digits of this chunk only,
+            # keep room for the wider values of the next ones
+            return array.cast(pa.decimal128(38, array.type.scale))
+        return array
+
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = None
+    if array is not None and array.type == field.type:
+        return array
+    if pa.types.is_string(field.type):
+        return pa.array(
+            [None if value is None else str(value) for value in values],
+            type=pa.string(),
+        )
+    try:
+        if array is None:
+            raise pa.ArrowInvalid("mixed types within the chunk")
+        # A safe cast fails instead of truncating, e.g. 2.5 into an integer
+        return array.cast(field.type, safe=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise ValueError(
+            f"Column {field.name} changes type from {field.type} "
+            f"after the first chunk: {e}"
+        ) from e
+
+
+class SpooledResult:
+    """Handle on a query result spooled to an Arrow IPC or Parquet file.
+
+    Only the file path and the batch layout are kept in memory. Rows are
+    read back batch by batch, so a page of a large result only reads the
+    batches it overlaps.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        columns: list[str],
+        batch_sizes: list[int],
+    ) -> None:
+        self.path = Path(path)
+        self.format = "parquet" if self.path.suffix == ".parquet" else "arrow"
+        self.columns = columns
+        self.batch_sizes = batch_sizes
+        self._offsets = [0]
+        for size in batch_sizes:
+            self._offsets.append(self._offsets[-1] + size)
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "SpooledResult":
+        """Reopens a spooled file from its path, e.g. one kept in an agent history"""
+        path = Path(path)
+        if path.suffix == ".parquet":
+            metadata = pq.ParquetFile(path).metadata
+            batch_sizes = [
+                metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)
+            ]
+            columns = metadata.schema.to_arrow_schema().names
+        else:
+            with pa.memory_map(str(path)) as source:
+                reader = pa.ipc.open_file(source)
+                columns = reader.schema.names
+                batch_sizes = [
+                    reader.get_batch(i).num_rows
+                    for i in range(reader.num_record_batches)
+                ]
+        return cls(path=path, columns=columns, batch_sizes=batch_sizes)
+
+    @property
+    def num_rows(self) -> int:
+        return self._offsets[-1]
+
+    @property
+    def size_bytes(self) -> int:
+        return self.path.stat().st_size
+
+    def _read_batches(self, indices: Sequence[int]) -> Iterator["pa.RecordBatch"]:
+        if self.format == "parquet":
+            parquet_file = pq.ParquetFile(self.path)
+            for index in indices:
+                yield from parquet_file.read_row_group(index).to_batches()
+        else:
+            with pa.memory_map(str(self.path)) as source:
+                reader = pa.ipc.open_file(source)
+                for index in indices:
+                    yield reader.get_batch(index)
+
+    def iter_batches(self) -> Iterator["pa.RecordBatch"]:
+        """Yields the result as Arrow record batches"""
+        return self._read_batches(range(len(self.batch_sizes)))
+
+    def iter_rows(self) -> Iterator[list[tuple]]:
+        """Yields the result as chunks of row tuples, like `stream_sql`"""
+        for batch in self.iter_batches():
+            columns = batch.to_pydict().values()
+            yield list(zip(*columns))
+
+    def page(self, offset: int, limit: int) -> pd.DataFrame:
+        """Returns `limit` rows starting at row `offset` as a DataFrame"""
+        offset = max(offset, 0)
+        stop = min(offset + limit, self.num_rows)
+        if offset >= stop:
+            return pd.DataFrame(columns=self.columns)
+
+        first = bisect_right(self._offsets, offset) - 1
+        last = bisect_right(self._offsets, stop - 1) - 1
+        table = pa.Table.from_batches(list(self._read_batches(range(first, last + 1))))
+        start = offset - self._offsets[first]
+        return table.slice(start, stop - offset).to_pandas()
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Loads the whole result, only meant for results which fit in memory"""
+        if self.format == "parquet":
+            return pq.read_table(self.path).to_pandas()
+        with pa.memory_map(str(self.path)) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+
+    def write_csv(self, destination: Union[str, Path]) -> None:
+        """Streams the result out to a CSV file, one batch at a time"""
+        writer = None
+        try:
+            for batch in self.iter_batches():
+                if writer is None:
+                    writer = pa_csv.CSVWriter(str(destination), batch.schema)
+                writer.write_batch(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            Path(destination).write_text(",".join(self.columns) + "\n")
+
+    def to_dict(self) -> dict:
+        return {
+            "path": str(self.path),
+            "format": self.format,
+            "columns": self.columns,
+            "num_rows": self.num_rows,
+        }
+
+    def cleanup(self) -> None:
+        """Deletes the spooled file"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledResult":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+    def __repr__(self) -> str:
+        return (
+            f"SpooledResult(path={str(self.path)!r}, format={self.format!r}, "
+            f"num_rows={self.num_rows}, columns={self.columns})"
+        )
+
+
+class ResultSpooler:
+    """Writes chunks of result rows to a temporary Arrow IPC or Parquet file.
+
+    Every chunk becomes one record batch (Arrow) or row group (Parquet),
+    so only one chunk is held in memory at a time. Column types are
+    inferred from the first chunk; columns which are empty in the first
+    chunk are stored as text. Values are written as the cursor returns
+    them; a later value which does not fit the type of its column without
+    loss (such as 2.5 in a column of integers) fails the spool with a
+    ValueError rather than being truncated. Files are created in
+    `spool_dir` (the temporary directory by default) and removed by
+    `cleanup`.
+    """
+
+    def __init__(
+        self,
+        spool_dir: Optional[Union[str, Path]] = None,
+        format: Optional[Literal["arrow", "parquet"]] = "arrow",
+        compression: Optional[str] = None,
+    ) -> None:
+        assert format in ["arrow", "parquet"], "format should be arrow or parquet"
+        self.spool_dir = Path(
+            spool_dir or Path(tempfile.gettempdir()) / "premsql_spool"
+        )
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.format = format
+        self.compression = compression
+
+        self._lock = threading.Lock()
+        self._spooled: list[SpooledResult] = []
+
+    def _open_writer(self, path: Path, schema: "pa.Schema"):
+        if self.format == "parquet":
+            return pq.ParquetWriter(
+                str(path), schema, compression=self.compression or "snappy"
+            )
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        return pa.ipc.new_file(str(path), schema, options=options)
+
+    def spool(
+        self, chunks: Iterable[Sequence], columns: Optional[list[str]] = None
+    ) -> SpooledResult:
+        """Writes chunks of rows to a new spool file and returns its handle"""
+        path = self.spool_dir / f"{uuid.uuid4().hex}{_SUFFIXES[self.format]}"
+        schema, writer, batch_sizes = None, None, []
+        try:
+            for chunk in chunks:
+                rows = [tuple(row) for row in chunk]
+                if not rows:
+                    continue
+                if columns is None:
+                    columns = [f"column_{i}" for i in range(len(rows[0]))]
+
+                values = [list(column) for column in zip(*rows)]
+                if schema is None:
+                    arrays = [_column_array(column) for column in values]
+                    schema = pa.schema(
+                        [
+                            pa.field(name, array.type)
+                            for name, array in zip(columns, arrays)
+                        ]
+                    )
+                    writer = self._open_writer(path, schema)
+                else:
+                    arrays = [
+                        _column_array(column, field)
+                        for column, field in zip(values, schema)
+                    ]
+
+                batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+                if self.format == "parquet":
+                    writer.write_table(pa.Table.from_batches([batch]))
+                else:
+                    writer.write_batch(batch)
+                batch_sizes.append(len(rows))
+
+            if writer is None:
+                # Empty result, keep its columns
+                schema = pa.schema(
+                    [pa.field(name, pa.string()) for name in columns or []]
+                )
+                writer = self._open_writer(path, schema)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            if path.exists():
+                os.remove(path)
+            raise
+        writer.close()
+
+        spooled = SpooledResult(
+            path=path, columns=list(schema.names), batch_sizes=batch_sizes
+        )
+        with self._lock:
+            self._spooled.append(spooled)
+        logger.info(
+            f"Spooled {spooled.num_rows} rows to {path} ({spooled.size_bytes / 1e6:.1f} MB)"
+        )
+        return spooled
+
+    def cleanup(self) -> None:
+        """Deletes every file spooled by this spooler"""
+        with self._lock:
+            spooled, self._spooled = self._spooled, []
+        for result in spooled:
+            result.cleanup()
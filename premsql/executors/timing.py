@@ -0,0 +1,89 @@
+import random
+from typing import Callable, Literal, Optional
+
+import numpy as np
+
+
+class TimingHarness:
+    """Measures the relative speed of a predicted and a gold query for VES.
+
+    Both queries are first run `num_warmup` times without being recorded.
+    Every iteration then runs the pair in a random order, so neither query
+    systematically benefits from the caches warmed by the other. With
+    `cache_mode="cold"` the `reset_cache` callback (e.g. dropping the sqlite
+    page cache) is invoked before every timed run.
+
+    The reported ratio follows BIRD: gold time / predicted time, summarised
+    by its median, inter-quartile range and a bootstrap confidence interval
+    of the median.
+    """
+
+    def __init__(
+        self,
+        num_warmup: Optional[int] = 2,
+        cache_mode: Optional[Literal["warm", "cold"]] = "warm",
+        confidence: Optional[float] = 0.95,
+        num_bootstrap: Optional[int] = 1000,
+        seed: Optional[int] = None,
+    ) -> None:
+        assert cache_mode in ["warm", "cold"], "cache_mode should be warm or cold"
+        assert 0 < confidence < 1, "confidence should be between 0 and 1"
+        self.num_warmup = num_warmup
+        self.cache_mode = cache_mode
+        self.confidence = confidence
+        self.num_bootstrap = num_bootstrap
+        self.seed = seed
+
+    def measure(
+        self,
+        run_predicted: Callable[[], int],
+        run_gold: Callable[[], int],
+        num_iterations: int,
+        reset_cache: Optional[Callable[[], None]] = None,
+    ) -> dict:
+        """Runs both callables, each returning its elapsed time in nanoseconds"""
+        assert num_iterations > 0, "num_iterations should be greater than 0"
+        rng = random.Random(self.seed)
+
+        for _ in range(self.num_warmup):
+            run_predicted()
+            run_gold()
+
+        predicted_times, gold_times = [], []
+        for _ in range(num_iterations):
+            runs = [(run_predicted, predicted_times), (run_gold, gold_times)]
+            rng.shuffle(runs)
+            for run, times in runs:
+                if self.cache_mode == "cold" and reset_cache is not None:
+                    reset_cache()
+                times.append(max(run(), 1))
+
+        return self.summarize(predicted_times=predicted_times, gold_times=gold_times)
+
+    def summarize(self, predicted_times: list[int], gold_times: list[int]) -> dict:
+        predicted = np.asarray(predicted_times, dtype=np.float64)
+        gold = np.asarray(gold_times, dtype=np.float64)
+        ratios = gold / predicted
+
+        q25, median, q75 = np.percentile(ratios, [25, 50, 75])
+        ci_low, ci_high = self._bootstrap_median_ci(ratios)
+        return {
+            "ratio": float(median),
+            "ratio_iqr": float(q75 - q25),
+            "ratio_ci": [ci_low, ci_high],
+            "confidence": self.confidence,
+            "predicted_time_median": float(np.median(predicted)) / 1e9,
+            "gold_time_median": float(np.median(gold)) / 1e9,
+            "num_iterations": len(ratios),
+        }
+
+    def _bootstrap_median_ci(self, values: np.ndarray) -> list[float]:
+        if len(values) < 2:
+            return [float(values[0]), float(values[0])]
+
+        rng = np.random.default_rng(self.seed)
+        samples = rng.choice(values, size=(self.num_bootstrap, len(values)), replace=True)
+        medians = np.median(samples, axis=1)
+        alpha = (1 - self.confidence) / 2
+        low, high = np.quantile(medians, [alpha, 1 - alpha])
+        return [float(low), float(high)]
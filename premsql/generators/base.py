@@ -1,8 +1,7 @@
-import json
 import re
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional, Union
 
 import sqlparse
 from tqdm.auto import tqdm
@@ -11,6 +10,12 @@ from platformdirs import user_cache_dir
 from premsql.evaluator.base import BaseExecutor
 from premsql.logger import setup_console_logger
 from premsql.prompts import ERROR_HANDLING_PROMPT
+from premsql.records import (
+    ExperimentRecords,
+    ExperimentWriter,
+    find_records,
+    records_path,
+)
 
 logger = setup_console_logger(name="[GENERATOR]")
 
@@ -115,11 +120,12 @@ class Text2SQLGeneratorBase(ABC):
         return sqlparse.format(sql_statement.split("# SQL:")[-1].strip())
 
     def load_results_from_folder(self):
-        item_names = [item.name for item in self.experiment_path.iterdir()]
-
-        if self.experiment_path.exists() and "predict.json" in item_names:
-            return json.load(open(self.experiment_path / "predict.json", "r"))
-        return None
+        predict_path = find_records(self.experiment_path, "predict")
+        if predict_path is None:
+            return None
+        # JSONL results are read lazily, predict.json as a list like before
+        records = ExperimentRecords(predict_path)
+        return records.to_list() if records.format == "json" else records
 
     def generate_and_save_results(
         self,
@@ -130,38 +136,54 @@ class Text2SQLGeneratorBase(ABC):
         postprocess: Optional[bool] = False,
         executor: Optional[BaseExecutor] = None,
         max_retries: Optional[int] = 5,
+        output_format: Optional[Literal["json", "jsonl"]] = "json",
+        compression: Optional[Literal["zstd"]] = None,
         **kwargs,
-    ) -> dict:
-
+    ) -> Union[list[dict], ExperimentRecords]:
+        """Generates the SQL of every example and streams it to predict.json.
+
+        With `output_format="jsonl"` the results go to predict.jsonl
+        (predict.jsonl.zst with `compression="zstd"`) and are returned as lazy
+        `ExperimentRecords` instead of a list, so they are never all held in
+        memory.
+        """
         existing_response = self.load_results_from_folder()
         if existing_response is not None and force == False:
             logger.info("Already results found")
             return existing_response
 
-        to_dump = []
-        for content in tqdm(dataset, total=len(dataset), desc="Generating result ..."):
-            sql = (
-                self.execution_guided_decoding(
-                    data_blob=content,
-                    executor=executor,
-                    temperature=temperature,
-                    postprocess=postprocess,
-                    max_new_tokens=max_new_tokens,
-                    max_retries=max_retries,
-                    **kwargs,
-                )
-                if executor is not None
-                else self.generate(
-                    data_blob=content,
-                    temperature=temperature,
-                    max_new_tokens=max_new_tokens,
-                    postprocess=postprocess,
-                    **kwargs,
+        predict_path = records_path(
+            self.experiment_path, "predict", format=output_format, compression=compression
+        )
+        to_dump = [] if output_format == "json" else None
+        with ExperimentWriter(predict_path) as writer:
+            for content in tqdm(
+                dataset, total=len(dataset), desc="Generating result ..."
+            ):
+                sql = (
+                    self.execution_guided_decoding(
+                        data_blob=content,
+                        executor=executor,
+                        temperature=temperature,
+                        postprocess=postprocess,
+                        max_new_tokens=max_new_tokens,
+                        max_retries=max_retries,
+                        **kwargs,
+                    )
+                    if executor is not None
+                    else self.generate(
+                        data_blob=content,
+                        temperature=temperature,
+                        max_new_tokens=max_new_tokens,
+                        postprocess=postprocess,
+                        **kwargs,
+                    )
                 )
-            )
 
-            to_dump.append({**content, "generated": sql})
+                record = {**content, "generated": sql}
+                writer.write(record)
+                if to_dump is not None:
+                    to_dump.append(record)
 
-        json.dump(to_dump, open(self.experiment_path / "predict.json", "w"), indent=4)
         logger.info(f"All responses are written to: {self.experiment_path}")
-        return to_dump
+        return to_dump if to_dump is not None else ExperimentRecords(predict_path)
@@ -1,3 +1,4 @@
+import asyncio
 import traceback
 
 from contextlib import asynccontextmanager
@@ -47,6 +48,9 @@ class AgentServer:
         self.agent = agent
         self.port = port
         self.url = url
+        # The agent is not thread-safe, so calls are serialized while being
+        # run outside of the event loop.
+        self._agent_lock = asyncio.Lock()
         self.app = self.create_app()
 
     @asynccontextmanager
@@ -72,8 +76,11 @@ class AgentServer:
         @app.post("/completion", response_model=CompletionResponse)
         async def completion(input_data: QuestionInput):
             try:
-                result = self.agent(question=input_data.question, server_mode=True)
-                message_id = self.agent.history.get_latest_message_id()
+                async with self._agent_lock:
+                    result = await asyncio.to_thread(
+                        self.agent, question=input_data.question, server_mode=True
+                    )
+                    message_id = self.agent.history.get_latest_message_id()
                 return CompletionResponse(
                     message=AgentOutput(**result.model_dump()), message_id=message_id
                 )
@@ -0,0 +1,192 @@
+import io
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, Optional, Union
+
+from premsql.logger import setup_console_logger
+
+logger = setup_console_logger(name="[RECORDS]")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_ZSTD_SUFFIX = ".zst"
+
+
+def records_path(
+    folder: Union[str, Path],
+    name: str,
+    format: Optional[Literal["json", "jsonl"]] = "json",
+    compression: Optional[Literal["zstd"]] = None,
+) -> Path:
+    """Path of an experiment file, e.g. predict.json or predict.jsonl.zst"""
+    assert format in ["json", "jsonl"], "format should be json or jsonl"
+    assert compression in [None, "zstd"], "compression should be None or zstd"
+    suffix = f".{format}" + (_ZSTD_SUFFIX if compression == "zstd" else "")
+    return Path(folder) / f"{name}{suffix}"
+
+
+def find_records(folder: Union[str, Path], name: str) -> Optional[Path]:
+    """Returns the first existing experiment file of that name, in any format"""
+    for format in ["json", "jsonl"]:
+        for compression in [None, "zstd"]:
+            path = records_path(folder, name, format=format, compression=compression)
+            if path.exists():
+                return path
+    return None
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError(
+            "zstd compressed records need zstandard, install it by: pip install zstandard"
+        )
+
+
+class ExperimentWriter:
+    """Streams records to a JSONL or JSON file, optionally zstd compressed.
+
+    Records are written one at a time, so a whole experiment never has to be
+    held in memory. The format follows the file suffix: `.jsonl` writes one
+    record per line, `.json` writes the list layout of `json.dump(records,
+    indent=4)` so existing readers of predict.json keep working, and a
+    trailing `.zst` compresses either of them.
+
+    Records go to a temporary file next to `path` which replaces it on
+    `close`, so a crashed run never leaves a partial file behind and the
+    file being written can also be the one the records are read from.
+    Leaving the `with` block on an exception (or calling `abort`) drops the
+    temporary file.
+    """
+
+    def __init__(self, path: Union[str, Path], compression_level: Optional[int] = 3):
+        self.path = Path(path)
+        self.compressed = self.path.suffix == _ZSTD_SUFFIX
+        format_suffix = Path(self.path.stem).suffix if self.compressed else self.path.suffix
+        self.format = "json" if format_suffix == ".json" else "jsonl"
+        self.compression_level = compression_level
+        self.num_records = 0
+        self._file = None
+        self._temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+
+    def open(self) -> "ExperimentWriter":
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.compressed:
+            _require_zstandard()
+            compressor = zstandard.ZstdCompressor(level=self.compression_level)
+            binary = compressor.stream_writer(
+                open(self._temp_path, "wb"), closefd=True
+            )
+        else:
+            binary = open(self._temp_path, "wb")
+        self._file = io.TextIOWrapper(binary, encoding="utf-8")
+        if self.format == "json":
+            self._file.write("[")
+        return self
+
+    def write(self, record: dict) -> None:
+        if self.format == "jsonl":
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            separator = "," if self.num_records else ""
+            content = json.dumps(record, indent=4, ensure_ascii=False)
+            self._file.write(separator + "\n    " + content.replace("\n", "\n    "))
+        self.num_records += 1
+
+    def write_all(self, records: Iterable[dict]) -> int:
+        for record in records:
+            self.write(record)
+        return self.num_records
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        if self.format == "json":
+            self._file.write("\n]" if self.num_records else "]")
+        self._file.close()
+        self._file = None
+        os.replace(self._temp_path, self.path)
+        logger.info(f"Wrote {self.num_records} records to: {self.path}")
+
+    def abort(self) -> None:
+        """Drops the records written so far, `path` is left untouched"""
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        finally:
+            self._file = None
+            if self._temp_path.exists():
+                os.remove(self._temp_path)
+
+    def __enter__(self) -> "ExperimentWriter":
+        return self.open()
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ExperimentRecords:
+    """Lazy, re-iterable view over the records of an experiment file.
+
+    JSONL files (plain or `.zst`) are read one line at a time on every
+    iteration. JSON list files have to be parsed as a whole and are loaded
+    on iteration.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.compressed = self.path.suffix == _ZSTD_SUFFIX
+        format_suffix = Path(self.path.stem).suffix if self.compressed else self.path.suffix
+        self.format = "json" if format_suffix == ".json" else "jsonl"
+
+    def _open_text(self) -> io.TextIOBase:
+        if self.compressed:
+            _require_zstandard()
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                open(self.path, "rb"), closefd=True
+            )
+            return io.TextIOWrapper(reader, encoding="utf-8")
+        return open(self.path, "r", encoding="utf-8")
+
+    def __iter__(self) -> Iterator[dict]:
+        with self._open_text() as text_file:
+            if self.format == "json":
+                yield from json.load(text_file)
+                return
+            for line in text_file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_list(self) -> list[dict]:
+        return list(self)
+
+    def __repr__(self) -> str:
+        return f"ExperimentRecords(path={str(self.path)!r})"
+
+
+def export_to_json(
+    source: Union[str, Path], destination: Optional[Union[str, Path]] = None
+) -> Path:
+    """Converts a JSONL experiment file to the predict.json list layout.
+
+    The records are streamed from one file to the other. By default the JSON
+    file is written next to the source, e.g. predict.jsonl.zst to
+    predict.json.
+    """
+    source = Path(source)
+    if destination is None:
+        name = source.name.split(".")[0]
+        destination = source.parent / f"{name}.json"
+    with ExperimentWriter(destination) as writer:
+        writer.write_all(ExperimentRecords(source))
+    return Path(destination)
@@ -0,0 +1,146 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Optional
+
+# SQLite keywords (https://www.sqlite.org/lang_keywords.html)
+SQLITE_KEYWORDS = frozenset(
+    """
+    ABORT ACTION ADD AFTER ALL ALTER ALWAYS ANALYZE AND AS ASC ATTACH
+    AUTOINCREMENT BEFORE BEGIN BETWEEN BY CASCADE CASE CAST CHECK COLLATE
+    COLUMN COMMIT CONFLICT CONSTRAINT CREATE CROSS CURRENT CURRENT_DATE
+    CURRENT_TIME CURRENT_TIMESTAMP DATABASE DEFAULT DEFERRABLE DEFERRED DELETE
+    DESC DETACH DISTINCT DO DROP EACH ELSE END ESCAPE EXCEPT EXCLUDE EXCLUSIVE
+    EXISTS EXPLAIN FAIL FILTER FIRST FOLLOWING FOR FOREIGN FROM FULL GENERATED
+    GLOB GROUP GROUPS HAVING IF IGNORE IMMEDIATE IN INDEX INDEXED INITIALLY
+    INNER INSERT INSTEAD INTERSECT INTO IS ISNULL JOIN KEY LAST LEFT LIKE LIMIT
+    MATCH MATERIALIZED NATURAL NO NOT NOTHING NOTNULL NULL NULLS OF OFFSET ON
+    OR ORDER OTHERS OUTER OVER PARTITION PLAN PRAGMA PRECEDING PRIMARY QUERY
+    RAISE RANGE RECURSIVE REFERENCES REGEXP REINDEX RELEASE RENAME REPLACE
+    RESTRICT RETURNING RIGHT ROLLBACK ROW ROWS SAVEPOINT SELECT SET TABLE TEMP
+    TEMPORARY THEN TIES TO TRANSACTION TRIGGER UNBOUNDED UNION UNIQUE UPDATE
+    USING VACUUM VALUES VIEW VIRTUAL WHEN WHERE WINDOW WITH WITHOUT
+    """.split()
+)
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<string>'(?:[^']|'')*'?)
+    | (?P<quoted>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+    | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<param>\?\d*|[:@$][A-Za-z_][A-Za-z0-9_]*)
+    | (?P<operator><>|!=|<=|>=|==|\|\||<<|>>|->>|->|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_NO_SPACE_BEFORE = frozenset([",", ")", ".", ";"])
+_NO_SPACE_AFTER = frozenset(["(", "."])
+_FUNCTION_KEYWORDS = frozenset(["CAST", "REPLACE", "LIKE", "GLOB"])
+
+
+def tokenize(sql: str) -> list[tuple[str, str]]:
+    """Splits SQL into (kind, text) tokens, without whitespace and comments"""
+    return [
+        (match.lastgroup, match.group())
+        for match in _TOKEN_PATTERN.finditer(sql)
+        if match.lastgroup not in ("space", "comment")
+    ]
+
+
+def _normalize_token(
+    kind: str, text: str, lowercase_identifiers: bool
+) -> tuple[str, str]:
+    if kind == "word":
+        upper = text.upper()
+        if upper in SQLITE_KEYWORDS:
+            return "keyword", upper
+        return "identifier", text.lower() if lowercase_identifiers else text
+
+    if kind == "quoted":
+        # Kept as is: SQLite reads a double quoted token which is not a
+        # column as a string literal, so "France" and "france" differ
+        return "identifier", text
+
+    if kind == "number":
+        return kind, text.lower()
+    return kind, text
+
+
+@lru_cache(maxsize=16384)
+def canonicalize(
+    sql: str,
+    parameterize_literals: Optional[bool] = False,
+    lowercase_identifiers: Optional[bool] = True,
+) -> str:
+    """Returns a canonical form of a SQLite query.
+
+    Whitespace and comments are normalized away, keywords are upper-cased,
+    unquoted identifiers lower-cased (unless `lowercase_identifiers` is
+    False, for databases where they are case sensitive), the optional `AS`
+    of column and table aliases is dropped and trailing semicolons removed.
+    Quoted tokens are kept byte for byte, so queries with the same canonical
+    form return the same result. With `parameterize_literals` every string
+    and number becomes `?`.
+    """
+    tokens = [
+        _normalize_token(kind, text, lowercase_identifiers)
+        for kind, text in tokenize(sql)
+    ]
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+
+    output: list[str] = []
+    # Tracks which open parentheses belong to a CAST, where AS is required
+    cast_parens: list[bool] = []
+    previous_kind, previous_text = None, None
+
+    for index, (kind, text) in enumerate(tokens):
+        next_kind = tokens[index + 1][0] if index + 1 < len(tokens) else None
+
+        if kind == "keyword" and text == "AS":
+            in_cast = bool(cast_parens) and cast_parens[-1]
+            if not in_cast and next_kind in ("identifier", "string"):
+                continue
+        if text == "(":
+            cast_parens.append(previous_text == "CAST")
+        elif text == ")" and cast_parens:
+            cast_parens.pop()
+
+        if parameterize_literals and kind in ("string", "number"):
+            text = "?"
+
+        if output and not (
+            text in _NO_SPACE_BEFORE
+            or previous_text in _NO_SPACE_AFTER
+            or (
+                text == "("
+                and (
+                    previous_kind == "identifier" or previous_text in _FUNCTION_KEYWORDS
+                )
+            )
+        ):
+            output.append(" ")
+        output.append(text)
+        previous_kind, previous_text = kind, text
+
+    return "".join(output)
+
+
+def fingerprint(
+    sql: str,
+    parameterize_literals: Optional[bool] = False,
+    lowercase_identifiers: Optional[bool] = True,
+) -> int:
+    """Returns a stable 64 bit fingerprint of the canonical form of a query"""
+    # Called the same way as canonicalize(sql) to share its lru_cache entries
+    if not lowercase_identifiers:
+        args = (sql, parameterize_literals, False)
+    else:
+        args = (sql, True) if parameterize_literals else (sql,)
+    canonical = canonicalize(*args)
+    return int.from_bytes(
+        hashlib.blake2b(canonical.encode(), digest_size=8).digest(), "big"
+    )